@@ -0,0 +1,92 @@
+import argparse
+import random
+import time
+import timeit
+
+from blabbermouth import markov_text
+
+_WORDS = (
+    "привет как дела ну да нет короче слушай вообще это самое тут там кот "
+    "пёс вечером сегодня завтра ладно ок норм блин жесть капец понял "
+    "спасибо пиво работа дом Вася Петя"
+).split()
+_PLAIN_EXTRAS = ["?", "!", "...", ",", "т.е."]
+_CHAT_EXTRAS = _PLAIN_EXTRAS + [
+    "))))",
+    ")",
+    "(",
+    "\U0001f602\U0001f602",
+    "\U0001f44d",
+    "https://youtu.be/dQw4w9WgXcQ",
+    "@vasya",
+    '"цитата"',
+]
+
+
+def _message(extras):
+    words = []
+    for _ in range(random.randint(1, 25)):
+        word = random.choice(_WORDS)
+        roll = random.random()
+        if roll < 0.15:
+            word += random.choice(extras)
+        elif roll < 0.2:
+            word = random.choice(extras)
+        words.append(word)
+        if random.random() < 0.05:
+            words.append("\n")
+    return " ".join(words)
+
+
+def _benchmark(name, corpus, tokenizer, repeat):
+    tokenize_time = min(
+        timeit.repeat(
+            lambda: [markov_text.tokenize(text, tokenizer) for text in corpus],
+            number=1,
+            repeat=repeat,
+        )
+    )
+    knowledge = [(markov_text.tokenize(text, tokenizer), 1) for text in corpus]
+    words = sum(len(run) for tokens, _ in knowledge for run in tokens)
+
+    started = time.perf_counter()
+    builder = markov_text.CompactText.builder()
+    builder.ingest(knowledge)
+    builder.build()
+    build_time = time.perf_counter() - started
+
+    print(
+        "{:6} {:10} tokenize {:.2f}s ({:.2f}us/word) build {:.2f}s "
+        "words kept {}".format(
+            name,
+            tokenizer.value,
+            tokenize_time,
+            tokenize_time / words * 1e6,
+            build_time,
+            words,
+        )
+    )
+
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+    corpora = {
+        "plain": [_message(_PLAIN_EXTRAS) for _ in range(args.messages)],
+        "chat": [_message(_CHAT_EXTRAS) for _ in range(args.messages)],
+    }
+    for name, corpus in corpora.items():
+        for tokenizer in markov_text.Tokenizer:
+            _benchmark(name, corpus, tokenizer, args.repeat)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+import asyncio
+import enum
 import random
 
 import attr
@@ -9,7 +11,24 @@ from blabbermouth.util.log import logged
 @logged
 @attr.s(slots=True)
 class AggregatingIntelligenceCore(IntelligenceCore):
-    _cores = attr.ib()
+    class Mode(enum.Enum):
+        SEQUENTIAL = "sequential"
+        RACING = "racing"
+
+    @attr.s(slots=True, frozen=True)
+    class Contender:
+        core = attr.ib()
+        weight = attr.ib()
+        timeout = attr.ib()
+
+        @weight.validator
+        def _check_weight(self, attribute, value):
+            if value < 0:
+                raise ValueError("weight must not be negative")
+
+    _contenders = attr.ib()
+    _mode = attr.ib(converter=Mode)
+    _hedge_delay = attr.ib()
 
     async def conceive(self):
         return await self._try_cores(lambda core: core.conceive())
@@ -17,15 +36,64 @@ class AggregatingIntelligenceCore(IntelligenceCore):
     async def respond(self, user, message):
         return await self._try_cores(lambda core: core.respond(user, message))
 
+    def close(self):
+        for contender in self._contenders:
+            contender.core.close()
+
     async def _try_cores(self, coro):
-        cores = self._cores.copy()
-        random.shuffle(cores)
-        for core in cores:
-            try:
-                result = await coro(core)
-            except Exception as ex:
-                self._log.exception(ex)
-            else:
-                if result is not None:
-                    return result
+        contenders = self._shuffled_contenders()
+        if self._mode == self.Mode.RACING:
+            return await self._race(contenders, coro)
+
+        for contender in contenders:
+            result = await self._try_contender(contender, coro)
+            if result is not None:
+                return result
         return None
+
+    async def _race(self, contenders, coro):
+        pending = set()
+        try:
+            while contenders or pending:
+                hedge_delay = None
+                if contenders:
+                    pending.add(
+                        asyncio.ensure_future(
+                            self._try_contender(contenders.pop(0), coro)
+                        )
+                    )
+                    hedge_delay = self._hedge_delay.total_seconds()
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=hedge_delay,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    if task.result() is not None:
+                        return task.result()
+            return None
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _try_contender(self, contender, coro):
+        try:
+            return await asyncio.wait_for(
+                coro(contender.core), contender.timeout.total_seconds()
+            )
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            self._log.warning(
+                "{} timed out".format(type(contender.core).__name__)
+            )
+        except Exception as ex:
+            self._log.exception(ex)
+        return None
+
+    def _shuffled_contenders(self):
+        return sorted(
+            (contender for contender in self._contenders if contender.weight),
+            key=lambda contender: random.random() ** (1 / contender.weight),
+            reverse=True,
+        )
@@ -19,6 +19,7 @@ def build(
     event_loop,
     intelligence_registry,
     knowledge_base,
+    knowledge_feed,
     telepot_http_timeout,
     conf,
 ):
@@ -38,6 +39,8 @@ def build(
             _make_per_chat_handler(
                 learning_handler.LearningHandler,
                 knowledge_base=knowledge_base,
+                knowledge_feed=knowledge_feed,
+                tokenizer=conf["core"]["tokenizer"],
                 self_reference_detector=query_detector.self_reference_detector(
                     bot_name
                 ),
@@ -0,0 +1,143 @@
+import asyncio
+import collections
+import hashlib
+import os
+
+import attr
+
+from blabbermouth.util.log import logged
+
+_TEMPORARY_SUFFIX = ".tmp"
+
+
+def _cache_key(text, voice, lang, audio_format, emotion):
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (text, voice, lang, audio_format, emotion.value):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+@logged
+@attr.s(slots=True)
+class CachingSpeechClient:
+    _speech_client = attr.ib()
+    _directory = attr.ib()
+    _memory_budget = attr.ib()
+    _disk_budget = attr.ib()
+    _memory = attr.ib(factory=collections.OrderedDict)
+    _memory_size = attr.ib(default=0)
+    _disk = attr.ib(factory=collections.OrderedDict)
+    _disk_size = attr.ib(default=0)
+    _in_flight = attr.ib(factory=dict)
+
+    def __attrs_post_init__(self):
+        os.makedirs(self._directory, exist_ok=True)
+        self._load()
+
+    async def vocalize(self, text, voice, lang, audio_format, emotion):
+        key = _cache_key(text, voice, lang, audio_format, emotion)
+        audio = self._memory.get(key)
+        if audio is not None:
+            self._memory.move_to_end(key)
+            return audio
+
+        audio = self._read(key)
+        if audio is not None:
+            self._remember(key, audio)
+            return audio
+
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(
+                self._vocalize(key, text, voice, lang, audio_format, emotion)
+            )
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key))
+        return await asyncio.shield(future)
+
+    async def _vocalize(self, key, text, voice, lang, audio_format, emotion):
+        audio = await self._speech_client.vocalize(
+            text=text,
+            voice=voice,
+            lang=lang,
+            audio_format=audio_format,
+            emotion=emotion,
+        )
+        self._write(key, audio)
+        self._remember(key, audio)
+        return audio
+
+    def _remember(self, key, audio):
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_size -= len(previous)
+        self._memory[key] = audio
+        self._memory_size += len(audio)
+        while self._memory_size > self._memory_budget:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def _read(self, key):
+        if key not in self._disk:
+            return None
+
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fd:
+                audio = fd.read()
+            os.utime(path)
+        except OSError as ex:
+            self._log.warning("Failed to read cached audio: {}".format(ex))
+            self._disk_size -= self._disk.pop(key)
+            return None
+
+        self._disk.move_to_end(key)
+        return audio
+
+    def _write(self, key, audio):
+        path = self._path(key)
+        try:
+            with open(path + _TEMPORARY_SUFFIX, "wb") as fd:
+                fd.write(audio)
+            os.replace(path + _TEMPORARY_SUFFIX, path)
+        except OSError as ex:
+            self._log.warning("Failed to cache audio: {}".format(ex))
+            return
+
+        self._disk_size += len(audio) - self._disk.pop(key, 0)
+        self._disk[key] = len(audio)
+        self._evict_disk()
+
+    def _evict_disk(self):
+        while self._disk_size > self._disk_budget:
+            key, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            try:
+                os.remove(self._path(key))
+            except OSError as ex:
+                self._log.warning(
+                    "Failed to evict cached audio: {}".format(ex)
+                )
+
+    def _load(self):
+        entries = []
+        for entry in os.scandir(self._directory):
+            if entry.name.endswith(_TEMPORARY_SUFFIX):
+                os.remove(entry.path)
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, entry.name, stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+        self._evict_disk()
+        self._log.info(
+            "Loaded {} cached audio files ({} bytes)".format(
+                len(self._disk), self._disk_size
+            )
+        )
+
+    def _path(self, key):
+        return os.path.join(self._directory, key)
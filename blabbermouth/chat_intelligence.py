@@ -1,20 +1,38 @@
+import collections
+
 import attr
 import telepot
 
 from blabbermouth.util.log import logged
 
 
+@logged
 @attr.s(slots=True)
 class IntelligenceRegistry:
     _core_constructor = attr.ib()
-    _cores = attr.ib(factory=dict)
+    _max_cores = attr.ib()
+    _cores = attr.ib(factory=collections.OrderedDict)
 
     def create_core(self, chat_id):
+        previous_core = self._cores.pop(chat_id, None)
         self._cores[chat_id] = self._core_constructor(chat_id)
+        if previous_core is not None:
+            previous_core.close()
+        self._evict()
 
     def get_core(self, chat_id):
+        if chat_id not in self._cores:
+            self._log.info("Recreating core for chat {}".format(chat_id))
+            self.create_core(chat_id)
+        self._cores.move_to_end(chat_id)
         return self._cores[chat_id]
 
+    def _evict(self):
+        while len(self._cores) > self._max_cores:
+            chat_id, core = self._cores.popitem(last=False)
+            self._log.info("Evicting core for chat {}".format(chat_id))
+            core.close()
+
 
 @logged
 class ChatIntelligence(telepot.aio.helper.ChatHandler):
@@ -0,0 +1,46 @@
+import re
+
+import markovify
+
+_EMOJI = (
+    "\U0001f000-\U0001faff"
+    "\u2300-\u23ff"
+    "\u2600-\u27bf"
+    "\u2b00-\u2bff"
+    "\ufe0f\u200d"
+)
+_EMOJI_PATTERN = re.compile("[{}]+".format(_EMOJI))
+_SENTENCE_BOUNDARY_PATTERN = re.compile(
+    r"(?<![a-z\u0430-\u044f\u0451]\.[a-z\u0430-\u044f\u0451]\.)"
+    r"(?<=[.!?\u2026])\s+"
+)
+
+
+def _separate_emoji(text):
+    if _EMOJI_PATTERN.search(text) is None:
+        return text
+    return _EMOJI_PATTERN.sub(r" \g<0> ", text)
+
+
+def _split(text):
+    for line in _separate_emoji(text).splitlines():
+        for sentence in _SENTENCE_BOUNDARY_PATTERN.split(line):
+            words = sentence.split()
+            if words:
+                yield words
+
+
+class ChatText(markovify.Text):
+    def generate_corpus(self, text):
+        if isinstance(text, str):
+            return _split(text)
+        return (run for line in text for run in _split(line))
+
+    def sentence_split(self, text):
+        return [self.word_join(run) for run in _split(text)]
+
+    def word_split(self, sentence):
+        return _separate_emoji(sentence).split()
+
+    def test_sentence_input(self, sentence):
+        return bool(sentence.strip())
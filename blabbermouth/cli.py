@@ -1,7 +1,9 @@
 import argparse
 import asyncio
-import concurrent.futures
+import datetime
 import functools
+import os
+import signal
 
 import aiohttp
 import attr
@@ -12,9 +14,13 @@ from blabbermouth import (
     bot_factory,
     chat_intelligence,
     intelligence_core_factory,
+    knowledge_base_factory,
+    model_host,
 )
-from blabbermouth.mongo_knowledge_base import MongoKnowledgeBase
+from blabbermouth.knowledge_feed import KnowledgeFeed
+from blabbermouth.model_snapshot import ModelSnapshotStore
 from blabbermouth.util import config, log
+from blabbermouth.write_behind_knowledge_base import WriteBehindKnowledgeBase
 
 
 @attr.s(slots=True)
@@ -43,25 +49,56 @@ async def run(args, event_loop):
 
     telepot.aio.api.set_proxy(conf["core"]["proxy"])
 
-    knowledge_base = MongoKnowledgeBase.build(
-        host=conf["mongo_knowledge_base"]["db_host"],
-        port=conf["mongo_knowledge_base"]["db_port"],
-        db_name=conf["mongo_knowledge_base"]["db_name"],
-        db_collection=conf["mongo_knowledge_base"]["db_collection"],
+    knowledge_base = WriteBehindKnowledgeBase(
+        event_loop=event_loop,
+        knowledge_base=await knowledge_base_factory.build(conf),
+        flush_size=conf["write_behind_knowledge_base"]["flush_size"],
+        flush_interval=datetime.timedelta(
+            seconds=conf["write_behind_knowledge_base"][
+                "flush_interval_seconds"
+            ]
+        ),
+        max_pending=conf["write_behind_knowledge_base"]["max_pending"],
+        close_timeout=datetime.timedelta(
+            seconds=conf["write_behind_knowledge_base"][
+                "close_timeout_seconds"
+            ]
+        ),
+    )
+    knowledge_feed = KnowledgeFeed()
+    model_snapshot_store = ModelSnapshotStore(
+        directory=os.path.join(
+            conf["markov_chain_intelligence_core"]["snapshot_directory"],
+            conf["core"]["knowledge_base"],
+        )
+    )
+
+    markov_text_cache = intelligence_core_factory.build_markov_text_cache(
+        event_loop=event_loop,
+        knowledge_base=knowledge_base,
+        knowledge_feed=knowledge_feed,
+        model_snapshot_store=model_snapshot_store,
+        markov_model_host=model_host.build(
+            event_loop=event_loop,
+            mode=conf["markov_chain_intelligence_core"]["worker_mode"],
+            workers=conf["markov_chain_intelligence_core"]["worker_count"],
+        ),
+        conf=conf,
     )
 
+    http_session = aiohttp.ClientSession()
     intelligence_registry = chat_intelligence.IntelligenceRegistry(
         core_constructor=functools.partial(
             intelligence_core_factory.build,
-            event_loop=event_loop,
-            knowledge_base=knowledge_base,
-            http_session=aiohttp.ClientSession(),
-            user_agent=conf["core"]["user_agent"],
-            markov_chain_worker=concurrent.futures.ThreadPoolExecutor(
-                max_workers=5
+            markov_text_cache=markov_text_cache,
+            speech_client=intelligence_core_factory.build_speech_client(
+                http_session=http_session, conf=conf
             ),
+            http_session=http_session,
+            user_agent=conf["core"]["user_agent"],
             conf=conf,
-        )
+        ),
+        max_cores=conf["intelligence_registry"]["max_cores"],
     )
 
     bot_accessor = BotAccessor()
@@ -73,17 +110,24 @@ async def run(args, event_loop):
             event_loop=event_loop,
             intelligence_registry=intelligence_registry,
             knowledge_base=knowledge_base,
+            knowledge_feed=knowledge_feed,
             telepot_http_timeout=conf["telepot"]["http_timeout"],
             conf=conf,
         )
     )
 
-    await MessageLoop(bot_accessor()).run_forever()
+    try:
+        await MessageLoop(bot_accessor()).run_forever()
+    finally:
+        await knowledge_base.close()
 
 
 def main():
     event_loop = asyncio.get_event_loop()
-    event_loop.create_task(run(parse_args(), event_loop))
+    task = event_loop.create_task(run(parse_args(), event_loop))
+    task.add_done_callback(lambda _: event_loop.stop())
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        event_loop.add_signal_handler(signum, task.cancel)
     event_loop.run_forever()
 
 
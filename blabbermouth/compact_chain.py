@@ -0,0 +1,240 @@
+import array
+import base64
+import bisect
+import random
+
+import attr
+from markovify.chain import BEGIN, END
+
+from blabbermouth.util import words as words_util
+
+_BEGIN_ID = 0
+_END_ID = 1
+_KEY_BITS = 64
+_WORD_BYTES = 64
+_TRANSITION_BYTES = 104
+_MIN_OVERLAY_STATES = 1 << 14
+_OVERLAY_RATIO = 8
+
+
+def _pack_array(values):
+    return {
+        "typecode": values.typecode,
+        "data": base64.b64encode(values.tobytes()).decode("ascii"),
+    }
+
+
+def _unpack_array(packed):
+    values = array.array(packed["typecode"])
+    values.frombytes(base64.b64decode(packed["data"]))
+    return values
+
+
+@attr.s(slots=True)
+class CompactChain:
+    state_size = attr.ib()
+    _words = attr.ib(factory=lambda: [BEGIN, END])
+    _word_ids = attr.ib(factory=lambda: {BEGIN: _BEGIN_ID, END: _END_ID})
+    _states = attr.ib(factory=lambda: array.array("Q"))
+    _offsets = attr.ib(factory=lambda: array.array("I", [0]))
+    _follows = attr.ib(factory=lambda: array.array("I"))
+    _weights = attr.ib(factory=lambda: array.array("I"))
+    _overlay = attr.ib(factory=dict)
+    _state_index = attr.ib(factory=dict)
+
+    @classmethod
+    def build(cls, corpus, state_size):
+        chain = cls(state_size=state_size)
+        chain.absorb(corpus)
+        chain.compact()
+        return chain
+
+    def absorb(self, corpus, weight=1):
+        begin = [_BEGIN_ID] * self.state_size
+        for run in corpus:
+            ids = begin + [self._intern(word) for word in run] + [_END_ID]
+            for start in range(len(run) + 1):
+                end = start + self.state_size
+                key = self._pack(ids[start:end])
+                follow = ids[end]
+                if key not in self._overlay and self._index(key) is None:
+                    self._index_state(key)
+                transitions = self._overlay.setdefault(key, {})
+                transitions[follow] = transitions.get(follow, 0) + weight
+        if len(self._overlay) >= max(
+            _MIN_OVERLAY_STATES, len(self._states) // _OVERLAY_RATIO
+        ):
+            self.compact()
+
+    def compact(self):
+        if not self._overlay:
+            return
+
+        states = array.array("Q")
+        offsets = array.array("I", [0])
+        follows = array.array("I")
+        weights = array.array("I")
+        index = 0
+        for key in sorted(self._overlay):
+            end = bisect.bisect_left(self._states, key, index)
+            self._copy_states(index, end, states, offsets, follows, weights)
+            index = end
+
+            transitions = {}
+            if index < len(self._states) and self._states[index] == key:
+                transitions.update(self._base_transitions(index))
+                index += 1
+            for follow, count in self._overlay[key].items():
+                transitions[follow] = transitions.get(follow, 0) + count
+
+            total = 0
+            for follow in sorted(transitions):
+                total += transitions[follow]
+                follows.append(follow)
+                weights.append(total)
+            states.append(key)
+            offsets.append(len(follows))
+        self._copy_states(
+            index, len(self._states), states, offsets, follows, weights
+        )
+
+        self._states = states
+        self._offsets = offsets
+        self._follows = follows
+        self._weights = weights
+        self._overlay = {}
+
+    def walk(self, init_state=None):
+        if init_state is None:
+            ids = [_BEGIN_ID] * self.state_size
+        else:
+            ids = [self._word_ids[word] for word in init_state]
+
+        words = []
+        while True:
+            follow = self._move(self._pack(ids))
+            if follow == _END_ID:
+                return words
+            words.append(self._words[follow])
+            ids = ids[1:] + [follow]
+
+    @property
+    def size_bytes(self):
+        arrays = [self._states, self._offsets, self._follows, self._weights]
+        arrays.extend(self._state_index.values())
+        return (
+            sum(values.itemsize * len(values) for values in arrays)
+            + (len(self._words) + len(self._state_index)) * _WORD_BYTES
+            + sum(map(len, self._overlay.values())) * _TRANSITION_BYTES
+        )
+
+    def states_with(self, word):
+        return self._state_index.get(word, ())
+
+    def unpack(self, key):
+        return tuple(self._words[word_id] for word_id in self._unpack(key))
+
+    def to_dict(self):
+        self.compact()
+        return {
+            "state_size": self.state_size,
+            "words": self._words,
+            "states": _pack_array(self._states),
+            "offsets": _pack_array(self._offsets),
+            "follows": _pack_array(self._follows),
+            "weights": _pack_array(self._weights),
+        }
+
+    @classmethod
+    def from_dict(cls, obj):
+        words = obj["words"]
+        chain = cls(
+            state_size=obj["state_size"],
+            words=words,
+            word_ids={word: word_id for word_id, word in enumerate(words)},
+            states=_unpack_array(obj["states"]),
+            offsets=_unpack_array(obj["offsets"]),
+            follows=_unpack_array(obj["follows"]),
+            weights=_unpack_array(obj["weights"]),
+        )
+        for key in chain._states:
+            chain._index_state(key)
+        return chain
+
+    def _intern(self, word):
+        word_id = self._word_ids.get(word)
+        if word_id is None:
+            word_id = len(self._words)
+            if word_id >> (_KEY_BITS // self.state_size):
+                raise OverflowError("Vocabulary is too large for state size")
+            self._word_ids[word] = word_id
+            self._words.append(word)
+        return word_id
+
+    def _pack(self, ids):
+        key = 0
+        for word_id in ids:
+            key = (key << (_KEY_BITS // self.state_size)) | word_id
+        return key
+
+    def _unpack(self, key):
+        bits = _KEY_BITS // self.state_size
+        mask = (1 << bits) - 1
+        return [
+            (key >> (bits * shift)) & mask
+            for shift in reversed(range(self.state_size))
+        ]
+
+    def _index_state(self, key):
+        words = {
+            words_util.normalize(self._words[word_id])
+            for word_id in self._unpack(key)
+            if word_id != _BEGIN_ID
+        }
+        for word in filter(None, words):
+            self._state_index.setdefault(word, array.array("Q")).append(key)
+
+    def _index(self, key):
+        index = bisect.bisect_left(self._states, key)
+        if index < len(self._states) and self._states[index] == key:
+            return index
+        return None
+
+    def _copy_states(self, start, end, states, offsets, follows, weights):
+        if start == end:
+            return
+        lo, hi = self._offsets[start], self._offsets[end]
+        shift = len(follows) - lo
+        states.extend(self._states[start:end])
+        follows.extend(self._follows[lo:hi])
+        weights.extend(self._weights[lo:hi])
+        first, last = start + 1, end + 1
+        offsets.extend(offset + shift for offset in self._offsets[first:last])
+
+    def _base_transitions(self, index):
+        previous = 0
+        for i in range(self._offsets[index], self._offsets[index + 1]):
+            yield self._follows[i], self._weights[i] - previous
+            previous = self._weights[i]
+
+    def _move(self, key):
+        index = self._index(key)
+        base_total = 0
+        if index is not None:
+            lo, hi = self._offsets[index], self._offsets[index + 1]
+            base_total = self._weights[hi - 1]
+        overlay = self._overlay.get(key, {})
+        total = base_total + sum(overlay.values())
+        if not total:
+            raise KeyError(key)
+
+        r = random.random() * total
+        if r < base_total:
+            return self._follows[bisect.bisect(self._weights, r, lo, hi)]
+
+        r -= base_total
+        for follow, count in overlay.items():
+            r -= count
+            if r < 0:
+                break
+        return follow
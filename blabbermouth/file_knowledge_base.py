@@ -0,0 +1,268 @@
+import array
+import bisect
+import hashlib
+import mmap
+import os
+import random
+import struct
+import time
+
+import attr
+
+from blabbermouth.knowledge_base import Changes, KnowledgeBase
+from blabbermouth.knowledge_source import Scope
+from blabbermouth.util.log import logged
+
+_HEADER = struct.Struct("<qdIHII")
+_COUNT = struct.Struct("<I")
+_COUNT_OFFSET = struct.calcsize("<qd")
+_OFFSET_BITS = 40
+_OFFSET_MASK = (1 << _OFFSET_BITS) - 1
+_SEGMENT_NAME = "segment-{:06d}.log"
+
+
+def _content_key(chat_id, user, text_data):
+    return chat_id, user, hashlib.blake2b(text_data, digest_size=16).digest()
+
+
+def _pack_tokens(tokens):
+    return "\n".join(" ".join(run) for run in tokens).encode("utf-8")
+
+
+def _unpack_tokens(data):
+    if not data:
+        return []
+    return [line.split(" ") for line in data.decode("utf-8").split("\n")]
+
+
+@logged
+@attr.s(slots=True)
+class FileKnowledgeBase(KnowledgeBase):
+    _directory = attr.ib()
+    _segment_size = attr.ib()
+    _dedupe_bucket = attr.ib()
+    _sizes = attr.ib(factory=list)
+    _views = attr.ib(factory=dict)
+    _positions = attr.ib(factory=lambda: array.array("Q"))
+    _stamps = attr.ib(factory=lambda: array.array("d"))
+    _chats = attr.ib(factory=dict)
+    _users = attr.ib(factory=dict)
+    _contents = attr.ib(factory=dict)
+    _contents_bucket = attr.ib(default=None)
+    _writer = attr.ib(default=None)
+
+    @classmethod
+    def open(cls, directory, segment_size, dedupe_bucket):
+        os.makedirs(directory, exist_ok=True)
+        knowledge_base = cls(
+            directory=directory,
+            segment_size=segment_size,
+            dedupe_bucket=dedupe_bucket,
+        )
+        knowledge_base._load()
+        return knowledge_base
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def record(self, chat_id, user, text, tokens):
+        await self.record_many([(chat_id, user, text, tokens, 1)])
+
+    async def record_many(self, records):
+        stamp = time.time()
+        bucket = self._bucket(stamp)
+        if bucket != self._contents_bucket:
+            self._contents = {}
+            self._contents_bucket = bucket
+
+        for chat_id, user, text, tokens, count in records:
+            user_data = user.encode("utf-8")
+            text_data = text.encode("utf-8")
+            key = _content_key(chat_id, user, text_data)
+            seq = self._contents.get(key)
+            if seq is not None:
+                self._add_count(seq, count)
+                continue
+
+            tokens_data = _pack_tokens(tokens)
+            data = (
+                _HEADER.pack(
+                    chat_id,
+                    stamp,
+                    count,
+                    len(user_data),
+                    len(text_data),
+                    len(tokens_data),
+                )
+                + user_data
+                + text_data
+                + tokens_data
+            )
+            if self._sizes[-1] and (
+                self._sizes[-1] + len(data) > self._segment_size
+            ):
+                self._roll()
+
+            segment = len(self._sizes) - 1
+            self._writer.write(data)
+            self._index(segment, self._sizes[segment], chat_id, user, stamp)
+            self._contents[key] = len(self._positions) - 1
+            self._sizes[segment] += len(data)
+        self._writer.flush()
+
+    async def high_water_mark(self):
+        return len(self._positions) - 1 if self._positions else None
+
+    async def select_changes(self, source, resume_token, limit):
+        seqs = self._source_seqs(source)
+        start = 0
+        if resume_token is not None:
+            start = bisect.bisect_right(seqs, resume_token)
+        end = min(start + limit, len(seqs))
+        selected = [seqs[i] for i in range(start, end)]
+        return Changes(
+            entries=[self._entry(seq) for seq in selected],
+            resume_token=selected[-1] if selected else resume_token,
+        )
+
+    async def select_by_full_knowledge(self, newer_than=None):
+        for entry in self._select(self._all_seqs(), newer_than):
+            yield entry
+
+    async def sample_full_knowledge(self, size, newer_than=None):
+        start = self._first_seq(newer_than)
+        seqs = range(start, len(self._positions))
+        for seq in random.sample(seqs, min(size, len(seqs))):
+            yield self._entry(seq)
+
+    async def select_by_chat(self, chat_id, newer_than=None):
+        for entry in self._select(self._chats.get(chat_id, ()), newer_than):
+            yield entry
+
+    async def select_by_user(self, user, newer_than=None):
+        for entry in self._select(self._users.get(user, ()), newer_than):
+            yield entry
+
+    def _select(self, seqs, newer_than):
+        start = bisect.bisect_left(seqs, self._first_seq(newer_than))
+        for i in range(start, len(seqs)):
+            yield self._entry(seqs[i])
+
+    def _all_seqs(self):
+        return range(len(self._positions))
+
+    def _source_seqs(self, source):
+        if source.scope == Scope.FULL_KNOWLEDGE:
+            return self._all_seqs()
+        if source.scope == Scope.CHAT:
+            return self._chats.get(source.key, ())
+        if source.scope == Scope.USER:
+            return self._users.get(source.key, ())
+        raise ValueError("Unexpected knowledge scope: {}".format(source.scope))
+
+    def _first_seq(self, newer_than):
+        if newer_than is None:
+            return 0
+        return bisect.bisect_left(self._stamps, newer_than.timestamp())
+
+    def _entry(self, seq):
+        position = self._positions[seq]
+        view = self._view(position >> _OFFSET_BITS)
+        offset = position & _OFFSET_MASK
+        header = _HEADER.unpack_from(view, offset)
+        _, _, count, user_length, text_length, tokens_length = header
+        start = offset + _HEADER.size + user_length + text_length
+        end = start + tokens_length
+        return _unpack_tokens(view[start:end]), count
+
+    def _add_count(self, seq, count):
+        self._writer.flush()
+        position = self._positions[seq]
+        view = self._view(position >> _OFFSET_BITS)
+        offset = (position & _OFFSET_MASK) + _COUNT_OFFSET
+        (current,) = _COUNT.unpack_from(view, offset)
+        fd = os.open(self._path(position >> _OFFSET_BITS), os.O_WRONLY)
+        try:
+            os.pwrite(fd, _COUNT.pack(current + count), offset)
+        finally:
+            os.close(fd)
+
+    def _bucket(self, stamp):
+        return int(stamp // self._dedupe_bucket.total_seconds())
+
+    def _view(self, segment):
+        view = self._views.get(segment)
+        if view is None or len(view) < self._sizes[segment]:
+            view = self._views[segment] = self._map(segment)
+        return view
+
+    def _map(self, segment):
+        with open(self._path(segment), "rb") as fd:
+            return mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _index(self, segment, offset, chat_id, user, stamp):
+        seq = len(self._positions)
+        self._positions.append((segment << _OFFSET_BITS) | offset)
+        self._stamps.append(stamp)
+        self._chats.setdefault(chat_id, array.array("Q")).append(seq)
+        self._users.setdefault(user, array.array("Q")).append(seq)
+
+    def _load(self):
+        self._contents_bucket = self._bucket(time.time())
+        segment = 0
+        while os.path.exists(self._path(segment)):
+            self._sizes.append(self._scan(segment))
+            segment += 1
+
+        if not self._sizes:
+            self._sizes.append(0)
+        self._writer = open(self._path(len(self._sizes) - 1), "ab")
+        self._log.info(
+            "Loaded {} entries from {} segments".format(
+                len(self._positions), len(self._sizes)
+            )
+        )
+
+    def _scan(self, segment):
+        path = self._path(segment)
+        size = os.path.getsize(path)
+        if not size:
+            return 0
+
+        view = self._map(segment)
+        offset = 0
+        while offset + _HEADER.size <= size:
+            header = _HEADER.unpack_from(view, offset)
+            chat_id, stamp, _, user_length, text_length, tokens_length = header
+            start = offset + _HEADER.size
+            user_end = start + user_length
+            end = user_end + text_length + tokens_length
+            if end > size:
+                break
+            text_end = user_end + text_length
+            user = view[start:user_end].decode("utf-8")
+            self._index(segment, offset, chat_id, user, stamp)
+            if self._bucket(stamp) == self._contents_bucket:
+                key = _content_key(chat_id, user, view[user_end:text_end])
+                self._contents[key] = len(self._positions) - 1
+            offset = end
+
+        if offset < size:
+            self._log.warning(
+                "Truncating torn tail of {} at {}".format(path, offset)
+            )
+            view.close()
+            os.truncate(path, offset)
+        else:
+            self._views[segment] = view
+        return offset
+
+    def _roll(self):
+        self._writer.close()
+        self._sizes.append(0)
+        self._writer = open(self._path(len(self._sizes) - 1), "ab")
+
+    def _path(self, segment):
+        return os.path.join(self._directory, _SEGMENT_NAME.format(segment))
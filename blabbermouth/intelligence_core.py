@@ -9,3 +9,6 @@ class IntelligenceCore(abc.ABC):
     @abc.abstractmethod
     async def respond(self, user, message):
         pass
+
+    def close(self):
+        pass
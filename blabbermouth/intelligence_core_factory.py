@@ -3,6 +3,8 @@ import datetime
 from blabbermouth.aggregating_intelligence_core import (
     AggregatingIntelligenceCore,
 )
+from blabbermouth.caching_speech_client import CachingSpeechClient
+from blabbermouth.knowledge_source import Scope
 from blabbermouth.markov_chain_intelligence_core import (
     MarkovChainIntelligenceCore,
 )
@@ -14,61 +16,158 @@ from blabbermouth.yandex_speech_client import Emotion as SpeechEmotion
 from blabbermouth.yandex_speech_client import YandexSpeechClient
 
 
-def build(
-    chat_id,
+def _days(days):
+    return datetime.timedelta(days=days) if days is not None else None
+
+
+def _contender(core, conf):
+    return AggregatingIntelligenceCore.Contender(
+        core=core,
+        weight=conf["weight"],
+        timeout=datetime.timedelta(milliseconds=conf["timeout_milliseconds"]),
+    )
+
+
+def build_markov_text_cache(
     event_loop,
     knowledge_base,
-    http_session,
-    user_agent,
-    markov_chain_worker,
+    knowledge_feed,
+    model_snapshot_store,
+    markov_model_host,
     conf,
 ):
-    markov_chain_core = MarkovChainIntelligenceCore.build(
+    return MarkovChainIntelligenceCore.build_text_cache(
         event_loop=event_loop,
-        worker=markov_chain_worker,
-        chat_id=chat_id,
+        model_host=markov_model_host,
         knowledge_base=knowledge_base,
-        knowledge_lifespan=datetime.timedelta(
+        knowledge_feed=knowledge_feed,
+        snapshot_store=model_snapshot_store,
+        engine=conf["markov_chain_intelligence_core"]["chain_engine"],
+        tokenizer=conf["core"]["tokenizer"],
+        ingest_batch_size=conf["markov_chain_intelligence_core"][
+            "ingest_batch_size"
+        ],
+        knowledge_window=_days(
+            conf["markov_chain_intelligence_core"]["knowledge_window_days"]
+        ),
+        full_knowledge_sample_size=conf["markov_chain_intelligence_core"][
+            "full_knowledge_sample_size"
+        ],
+        rebuild_thresholds={
+            Scope[scope.upper()]: threshold
+            for scope, threshold in conf["markov_chain_intelligence_core"][
+                "rebuild_thresholds"
+            ].items()
+        },
+        max_staleness=datetime.timedelta(
             minutes=conf["markov_chain_intelligence_core"][
-                "knowledge_lifespan_minutes"
+                "max_staleness_minutes"
             ]
         ),
         make_sentence_attempts=conf["markov_chain_intelligence_core"][
             "make_sentence_attempts"
         ],
+        sentence_pool_size=conf["markov_chain_intelligence_core"][
+            "sentence_pool_size"
+        ],
+        sentence_queue_size=conf["markov_chain_intelligence_core"][
+            "sentence_queue_size"
+        ],
+        sentence_budget=datetime.timedelta(
+            milliseconds=conf["markov_chain_intelligence_core"][
+                "sentence_budget_milliseconds"
+            ]
+        ),
+        fallback_margin=datetime.timedelta(
+            milliseconds=conf["markov_chain_intelligence_core"][
+                "fallback_margin_milliseconds"
+            ]
+        ),
+        refill_slice=datetime.timedelta(
+            milliseconds=conf["markov_chain_intelligence_core"][
+                "refill_slice_milliseconds"
+            ]
+        ),
+        memory_budget=conf["markov_chain_intelligence_core"][
+            "memory_budget_megabytes"
+        ]
+        * 1024
+        * 1024,
+    )
+
+
+def build_speech_client(http_session, conf):
+    return CachingSpeechClient(
+        speech_client=YandexSpeechClient(
+            http_session=http_session,
+            api_key=conf["yandex_cloud_token"],
+            api_url=conf["yandex_speech_client"]["api_url"],
+        ),
+        directory=conf["caching_speech_client"]["directory"],
+        memory_budget=conf["caching_speech_client"]["memory_budget_megabytes"]
+        * 1024
+        * 1024,
+        disk_budget=conf["caching_speech_client"]["disk_budget_megabytes"]
+        * 1024
+        * 1024,
+    )
+
+
+def build(
+    chat_id, markov_text_cache, speech_client, http_session, user_agent, conf
+):
+    markov_chain_core = MarkovChainIntelligenceCore.build(
+        chat_id=chat_id,
+        text_cache=markov_text_cache,
+        reply_budget=datetime.timedelta(
+            milliseconds=conf["markov_chain_intelligence_core"][
+                "reply_budget_milliseconds"
+            ]
+        ),
     )
+    contenders = conf["aggregating_intelligence_core"]["contenders"]
     return AggregatingIntelligenceCore(
-        cores=[
-            markov_chain_core,
-            SpeakingIntelligenceCore(
-                text_core=markov_chain_core,
-                speech_client=YandexSpeechClient(
-                    http_session=http_session,
-                    api_key=conf["yandex_cloud_token"],
-                    api_url=conf["yandex_speech_client"]["api_url"],
+        contenders=[
+            _contender(markov_chain_core, contenders["markov_chain"]),
+            _contender(
+                SpeakingIntelligenceCore(
+                    text_core=markov_chain_core,
+                    speech_client=speech_client,
+                    voice=conf["speaking_intelligence_core"]["voice"],
+                    lang=conf["speaking_intelligence_core"]["lang"],
+                    audio_format=conf["speaking_intelligence_core"][
+                        "audio_format"
+                    ],
+                    emotions=list(SpeechEmotion),
                 ),
-                voice=conf["speaking_intelligence_core"]["voice"],
-                lang=conf["speaking_intelligence_core"]["lang"],
-                audio_format=conf["speaking_intelligence_core"][
-                    "audio_format"
-                ],
-                emotions=list(SpeechEmotion),
+                contenders["speaking"],
             ),
-            RedditChatter(
-                reddit_browser=RedditBrowser.build(
-                    http_session=http_session,
-                    reddit_url=conf["reddit_browser"]["reddit_url"],
-                    user_agent=user_agent,
+            _contender(
+                RedditChatter(
+                    reddit_browser=RedditBrowser.build(
+                        http_session=http_session,
+                        reddit_url=conf["reddit_browser"]["reddit_url"],
+                        user_agent=user_agent,
+                    ),
+                    top_post_comments=conf["reddit_chatter"][
+                        "top_post_comments"
+                    ],
+                    subreddits_of_interest=conf["reddit_chatter"][
+                        "subreddits_of_interest"
+                    ],
+                    sort_types=[
+                        RedditFeedSortType.BEST,
+                        RedditFeedSortType.HOT,
+                        RedditFeedSortType.TOP,
+                    ],
                 ),
-                top_post_comments=conf["reddit_chatter"]["top_post_comments"],
-                subreddits_of_interest=conf["reddit_chatter"][
-                    "subreddits_of_interest"
-                ],
-                sort_types=[
-                    RedditFeedSortType.BEST,
-                    RedditFeedSortType.HOT,
-                    RedditFeedSortType.TOP,
-                ],
+                contenders["reddit"],
             ),
-        ]
+        ],
+        mode=conf["aggregating_intelligence_core"]["mode"],
+        hedge_delay=datetime.timedelta(
+            milliseconds=conf["aggregating_intelligence_core"][
+                "hedge_delay_milliseconds"
+            ]
+        ),
     )
@@ -1,19 +1,62 @@
 import abc
 
+import attr
+
+
+@attr.s(slots=True, frozen=True)
+class Changes:
+    entries = attr.ib()
+    resume_token = attr.ib()
+
+
+class PartialRecordError(Exception):
+    def __init__(self, failed_records):
+        super().__init__(
+            "Failed to record {} entries".format(len(failed_records))
+        )
+        self.failed_records = failed_records
+
 
 class KnowledgeBase(abc.ABC):
     @abc.abstractmethod
-    async def record(self, chat_id, user, text):
+    async def record(self, chat_id, user, text, tokens):
+        pass
+
+    async def close(self):
+        pass
+
+    async def record_many(self, records):
+        for index, (chat_id, user, text, tokens, count) in enumerate(records):
+            for recorded in range(count):
+                try:
+                    await self.record(chat_id, user, text, tokens)
+                except Exception as ex:
+                    failed = (chat_id, user, text, tokens, count - recorded)
+                    start = index + 1
+                    raise PartialRecordError(
+                        [failed] + list(records[start:])
+                    ) from ex
+
+    @abc.abstractmethod
+    async def high_water_mark(self):
+        pass
+
+    @abc.abstractmethod
+    async def select_changes(self, source, resume_token, limit):
+        pass
+
+    @abc.abstractmethod
+    async def select_by_full_knowledge(self, newer_than=None):
         pass
 
     @abc.abstractmethod
-    async def select_by_full_knowledge(self):
+    async def sample_full_knowledge(self, size, newer_than=None):
         pass
 
     @abc.abstractmethod
-    async def select_by_chat(self, chat_id):
+    async def select_by_chat(self, chat_id, newer_than=None):
         pass
 
     @abc.abstractmethod
-    async def select_by_user(self, user):
+    async def select_by_user(self, user, newer_than=None):
         pass
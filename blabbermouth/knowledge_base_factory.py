@@ -0,0 +1,40 @@
+import datetime
+import enum
+
+from blabbermouth.file_knowledge_base import FileKnowledgeBase
+from blabbermouth.mongo_knowledge_base import MongoKnowledgeBase
+
+
+class Backend(enum.Enum):
+    MONGO = "mongo"
+    FILE = "file"
+
+
+async def build(conf):
+    backend = Backend(conf["core"]["knowledge_base"])
+    dedupe_bucket = datetime.timedelta(
+        minutes=conf["core"]["dedupe_bucket_minutes"]
+    )
+    if backend == Backend.MONGO:
+        knowledge_base = MongoKnowledgeBase.build(
+            host=conf["mongo_knowledge_base"]["db_host"],
+            port=conf["mongo_knowledge_base"]["db_port"],
+            db_name=conf["mongo_knowledge_base"]["db_name"],
+            db_collection=conf["mongo_knowledge_base"]["db_collection"],
+            cursor_batch_size=conf["mongo_knowledge_base"][
+                "cursor_batch_size"
+            ],
+            tokenizer=conf["core"]["tokenizer"],
+            dedupe_bucket=dedupe_bucket,
+        )
+        await knowledge_base.create_indexes()
+        return knowledge_base
+    if backend == Backend.FILE:
+        return FileKnowledgeBase.open(
+            directory=conf["file_knowledge_base"]["directory"],
+            segment_size=conf["file_knowledge_base"]["segment_size_megabytes"]
+            * 1024
+            * 1024,
+            dedupe_bucket=dedupe_bucket,
+        )
+    raise ValueError("Unexpected knowledge base backend: {}".format(backend))
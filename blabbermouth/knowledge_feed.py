@@ -0,0 +1,33 @@
+import collections
+
+import attr
+
+from blabbermouth.knowledge_source import KnowledgeSource
+from blabbermouth.util.log import logged
+
+
+@logged
+@attr.s(slots=True)
+class KnowledgeFeed:
+    _subscribers = attr.ib(
+        factory=lambda: collections.defaultdict(list), repr=False
+    )
+
+    def subscribe(self, source, subscriber):
+        self._subscribers[source].append(subscriber)
+
+    def unsubscribe(self, source, subscriber):
+        subscribers = self._subscribers.get(source)
+        if subscribers is None:
+            return
+        subscribers.remove(subscriber)
+        if not subscribers:
+            del self._subscribers[source]
+
+    def publish(self, chat_id, user, tokens):
+        for source in KnowledgeSource.covering(chat_id, user):
+            for subscriber in tuple(self._subscribers.get(source, ())):
+                try:
+                    subscriber(tokens)
+                except Exception as ex:
+                    self._log.exception(ex)
@@ -0,0 +1,46 @@
+import enum
+
+import attr
+
+
+class Scope(enum.Enum):
+    FULL_KNOWLEDGE = enum.auto()
+    CHAT = enum.auto()
+    USER = enum.auto()
+
+
+@attr.s(slots=True, frozen=True)
+class KnowledgeSource:
+    scope = attr.ib(validator=attr.validators.instance_of(Scope))
+    key = attr.ib(default=None)
+
+    @classmethod
+    def full_knowledge(cls):
+        return cls(scope=Scope.FULL_KNOWLEDGE)
+
+    @classmethod
+    def chat(cls, chat_id):
+        return cls(scope=Scope.CHAT, key=chat_id)
+
+    @classmethod
+    def user(cls, user):
+        return cls(scope=Scope.USER, key=user)
+
+    @classmethod
+    def covering(cls, chat_id, user):
+        return (cls.full_knowledge(), cls.chat(chat_id), cls.user(user))
+
+    def select(self, knowledge_base, newer_than=None):
+        if self.scope == Scope.FULL_KNOWLEDGE:
+            return knowledge_base.select_by_full_knowledge(
+                newer_than=newer_than
+            )
+        if self.scope == Scope.CHAT:
+            return knowledge_base.select_by_chat(
+                self.key, newer_than=newer_than
+            )
+        if self.scope == Scope.USER:
+            return knowledge_base.select_by_user(
+                self.key, newer_than=newer_than
+            )
+        raise ValueError("Unexpected knowledge scope: {}".format(self.scope))
@@ -1,5 +1,6 @@
 import telepot
 
+from blabbermouth import markov_text
 from blabbermouth.knowledge_base import KnowledgeBase
 from blabbermouth.util.log import logged
 
@@ -10,6 +11,8 @@ class LearningHandler(telepot.aio.helper.ChatHandler):
         self,
         *args,
         knowledge_base,
+        knowledge_feed,
+        tokenizer,
         self_reference_detector,
         bot_name,
         event_loop,
@@ -21,6 +24,8 @@ class LearningHandler(telepot.aio.helper.ChatHandler):
         super(LearningHandler, self).__init__(*args, **kwargs)
 
         self._knowledge_base = knowledge_base
+        self._knowledge_feed = knowledge_feed
+        self._tokenizer = tokenizer
         self._self_reference_detector = self_reference_detector
         self._bot_name = bot_name
         self._event_loop = event_loop
@@ -42,10 +47,12 @@ class LearningHandler(telepot.aio.helper.ChatHandler):
             return
 
         chat_id = message["chat"]["id"]
+        tokens = markov_text.tokenize(text, self._tokenizer)
 
         await self._knowledge_base.record(
-            chat_id=chat_id, user=user, text=text
+            chat_id=chat_id, user=user, text=text, tokens=tokens
         )
+        self._knowledge_feed.publish(chat_id=chat_id, user=user, tokens=tokens)
 
     def on__idle(self, _):
         self._log.debug("Ignoring on__idle")
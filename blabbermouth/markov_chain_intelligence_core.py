@@ -1,100 +1,555 @@
-import contextlib
+import asyncio
+import collections
+import datetime
 import enum
 import functools
 import random
+import time
 
 import attr
-import markovify
 
-from blabbermouth import thought
+from blabbermouth import markov_text, thought
 from blabbermouth.intelligence_core import IntelligenceCore
 from blabbermouth.knowledge_base import KnowledgeBase
+from blabbermouth.knowledge_source import KnowledgeSource, Scope
+from blabbermouth.model_cache import ModelCache
+from blabbermouth.model_snapshot import ModelSnapshot
 from blabbermouth.util.lifespan import Lifespan
 from blabbermouth.util.log import logged
 
 
-async def _strip_dots(iterable):
-    async for entry in iterable:
-        if entry.endswith("."):
-            yield entry[:-1]
-        yield entry
+def _new_text_builder(engine):
+    return markov_text.text_class(engine).builder()
 
 
-async def _async_join(iterable, sep):
-    sep = sep.encode("utf-8")
-    b = bytearray()
-    try:
-        b += (await iterable.__anext__()).encode("utf-8")
-    except StopAsyncIteration:
-        return ""
-    async for s in iterable:
-        b += sep
-        b += s.encode("utf-8")
-    return b.decode("utf-8")
+def _ingest(builder, knowledge):
+    builder.ingest(knowledge)
+
+
+def _build_staged_text(builder):
+    return builder.build(), None
+
+
+def _text_from_snapshot(snapshot_store, source):
+    snapshot = snapshot_store.load(source)
+    if snapshot is None:
+        return None, None
+    return snapshot.text, snapshot.mark
+
+
+def _snapshot_text(text, snapshot_store, source, mark):
+    snapshot_store.save(source, ModelSnapshot(mark=mark, text=text))
+
+
+def _absorb(text, knowledge):
+    text.absorb(knowledge)
+
+
+def _text_size(text):
+    return text.size_bytes
+
+
+def _fallback_sentence(text, fallback, cutoff):
+    if fallback.words is None or time.monotonic() < cutoff:
+        return None
+    return text.word_join(fallback.words)
+
+
+def _make_sentence_about(text, words, tries, cutoff):
+    fallback = markov_text.Fallback()
+    sentence = text.make_sentence_about(
+        words, tries=tries, deadline=cutoff, fallback=fallback
+    )
+    if sentence is None:
+        sentence = _fallback_sentence(text, fallback, cutoff)
+    return sentence
+
+
+def _make_sentences(text, count, tries, cutoff, allow_fallback=False):
+    fallback = markov_text.Fallback() if allow_fallback else None
+    sentences = []
+    for _ in range(count):
+        sentence = text.make_sentence_until(
+            cutoff, tries=tries, fallback=fallback
+        )
+        if sentence is not None:
+            sentences.append(sentence)
+        if time.monotonic() >= cutoff:
+            break
+    if fallback is None or len(sentences) == count:
+        return sentences, None
+    return sentences, _fallback_sentence(text, fallback, cutoff)
 
 
 @logged
 @attr.s(slots=True)
 class CachedMarkovText:
+    class BuildState(enum.Enum):
+        RESTORING = enum.auto()
+        BUILDING = enum.auto()
+        READY = enum.auto()
+        FAILED = enum.auto()
+
     _event_loop = attr.ib()
-    _worker = attr.ib()
+    _model_host = attr.ib()
+    _knowledge_base = attr.ib(
+        validator=attr.validators.instance_of(KnowledgeBase)
+    )
+    _knowledge_feed = attr.ib()
     _knowledge_source = attr.ib()
+    _snapshot_store = attr.ib()
+    _engine = attr.ib(converter=markov_text.Engine)
+    _tokenizer = attr.ib(converter=markov_text.Tokenizer)
+    _ingest_batch_size = attr.ib()
+    _knowledge_window = attr.ib()
+    _full_knowledge_sample_size = attr.ib()
     _make_sentence_attempts = attr.ib()
-    _text_lifespan = attr.ib(converter=Lifespan)
-    _text = attr.ib(factory=lambda: markovify.Text("."))
+    _sentence_pool_size = attr.ib()
+    _sentence_queue_size = attr.ib()
+    _sentence_budget = attr.ib()
+    _fallback_margin = attr.ib()
+    _refill_slice = attr.ib()
+    _rebuild_threshold = attr.ib()
+    _max_staleness = attr.ib(converter=Lifespan)
+    _model_id = attr.ib(default=None)
+    _text_lock = attr.ib(factory=asyncio.Lock)
+    _text_version = attr.ib(default=0)
+    _text_is_ready = attr.ib(default=False)
+    _build_state = attr.ib(default=BuildState.RESTORING)
+    _build_started = attr.ib(default=None)
+    _last_build_duration = attr.ib(default=None)
     _sentence_is_building = attr.ib(default=False)
+    _sentence_waiters = attr.ib(factory=collections.deque)
+    _sentence_pool = attr.ib(default=None)
+    _sentence_pool_is_refilling = attr.ib(default=False)
+    _pending_knowledge = attr.ib(factory=list)
+    _new_knowledge_count = attr.ib(default=0)
+    _size_bytes = attr.ib(default=0)
+    _is_closed = attr.ib(default=False)
 
     def __attrs_post_init__(self):
-        self._schedule_new_text()
+        self._model_id = self._model_host.allocate()
+        self._sentence_pool = collections.deque(
+            maxlen=self._sentence_pool_size
+        )
+        self._knowledge_feed.subscribe(self._knowledge_source, self.learn)
+        self._event_loop.create_task(self._restore_text())
+        self._max_staleness.reset()
+
+    @property
+    def knowledge_source(self):
+        return self._knowledge_source
+
+    @property
+    def size_bytes(self):
+        return self._size_bytes
+
+    @property
+    def build_state(self):
+        return self._build_state
+
+    @property
+    def build_duration(self):
+        if self._build_state == self.BuildState.BUILDING:
+            return datetime.timedelta(
+                seconds=time.monotonic() - self._build_started
+            )
+        return self._last_build_duration
+
+    @property
+    def is_building(self):
+        return self._build_state in (
+            self.BuildState.RESTORING,
+            self.BuildState.BUILDING,
+        )
 
-    async def make_sentence(self):
-        if not self._text_lifespan:
+    def close(self):
+        self._is_closed = True
+        self._knowledge_feed.unsubscribe(self._knowledge_source, self.learn)
+        self._event_loop.create_task(self._drop_text())
+
+    def learn(self, tokens):
+        self._new_knowledge_count += 1
+        self._pending_knowledge.append((tokens, 1))
+        if len(self._pending_knowledge) == 1 and not self.is_building:
+            self._event_loop.create_task(self._absorb_pending_knowledge())
+        if self._text_is_outdated():
+            self._schedule_new_text()
+
+    def pooled_sentence(self):
+        if not self._sentence_pool:
+            return None
+        self._schedule_sentence_pool_refill()
+        return self._sentence_pool.popleft()
+
+    async def make_sentence(self, deadline=None):
+        if self._text_is_outdated():
             self._schedule_new_text()
 
-        if self._sentence_is_building:
-            self._log.info("Sentence is building")
+        if not self._text_is_ready:
+            self._log.info("Text is not ready yet")
+            return None
+
+        self._schedule_sentence_pool_refill()
+        if self._sentence_pool:
+            return self._sentence_pool.popleft()
+
+        deadline = self._deadline(deadline)
+        timeout = self._time_left(deadline)
+        if timeout <= 0:
+            return None
+        if len(self._sentence_waiters) >= self._sentence_queue_size:
+            self._log.warning(
+                "Sentence queue for {} is full, rejecting request".format(
+                    self._knowledge_source
+                )
+            )
             return None
 
-        sentence = None
-        with self._sentence_building_session():
-            sentence = await self._build_sentence()
-            if sentence is None:
-                self._log.error("Failed to produce sentence")
+        waiter = self._event_loop.create_future()
+        self._sentence_waiters.append((deadline, waiter))
+        if not self._sentence_is_building:
+            self._sentence_is_building = True
+            self._event_loop.create_task(self._serve_sentence_waiters())
 
+        try:
+            sentence = await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            self._log.warning(
+                "Ran out of time producing sentence for {}".format(
+                    self._knowledge_source
+                )
+            )
+            return None
+        if sentence is None:
+            self._log.error("Failed to produce sentence")
         return sentence
 
+    async def make_sentence_about(self, message, deadline=None):
+        if not self._text_is_ready:
+            return None
+
+        deadline = self._deadline(deadline)
+        generation = self._event_loop.create_task(
+            self._make_sentence_about(
+                markov_text.split_words(message, self._tokenizer),
+                self._cutoff(deadline),
+            )
+        )
+        done, _ = await asyncio.wait(
+            [generation], timeout=self._time_left(deadline)
+        )
+        if not done:
+            self._log.warning(
+                "Ran out of time replying to message for {}".format(
+                    self._knowledge_source
+                )
+            )
+            return None
+        return generation.result()
+
+    async def _make_sentence_about(self, words, cutoff):
+        try:
+            async with self._text_lock:
+                return await self._model_host.run(
+                    self._model_id,
+                    _make_sentence_about,
+                    words,
+                    self._make_sentence_attempts,
+                    cutoff,
+                )
+        except Exception as ex:
+            self._log.error(
+                "Failed to build sentence about message for {}: {}".format(
+                    self._knowledge_source, ex
+                )
+            )
+            return None
+
+    def _deadline(self, deadline=None):
+        if deadline is not None:
+            return deadline
+        return time.monotonic() + self._sentence_budget.total_seconds()
+
+    def _time_left(self, deadline):
+        return self._deadline(deadline) - time.monotonic()
+
+    def _cutoff(self, deadline):
+        return deadline - self._fallback_margin.total_seconds()
+
+    def _text_is_outdated(self):
+        if self.is_building:
+            return False
+        if self._build_state == self.BuildState.FAILED:
+            return not self._max_staleness
+        if not self._new_knowledge_count:
+            return False
+        return (
+            self._new_knowledge_count >= self._rebuild_threshold
+            or not self._max_staleness
+        )
+
     def _schedule_new_text(self):
+        self._log.info(
+            "Rebuilding text for {} after {} new entries of knowledge".format(
+                self._knowledge_source, self._new_knowledge_count
+            )
+        )
+        self._new_knowledge_count = 0
+        self._max_staleness.reset()
+        self._build_state = self.BuildState.BUILDING
+        self._build_started = time.monotonic()
         self._event_loop.create_task(self._build_text())
-        self._text_lifespan.reset()
+
+    def _on_new_text(self):
+        self._text_is_ready = True
+        self._text_version += 1
+        self._sentence_pool.clear()
+        self._schedule_sentence_pool_refill()
+
+    def _schedule_sentence_pool_refill(self):
+        if self._sentence_pool_is_refilling:
+            return
+        if len(self._sentence_pool) > self._sentence_pool_size // 2:
+            return
+        self._sentence_pool_is_refilling = True
+        self._event_loop.create_task(self._refill_sentence_pool())
+
+    async def _refill_sentence_pool(self):
+        try:
+            text_version = self._text_version
+            deadline = self._deadline()
+            while (
+                len(self._sentence_pool) < self._sentence_pool_size
+                and time.monotonic() < deadline
+            ):
+                async with self._text_lock:
+                    if text_version != self._text_version:
+                        return
+                    sentences, _ = await self._model_host.run(
+                        self._model_id,
+                        _make_sentences,
+                        self._sentence_pool_size - len(self._sentence_pool),
+                        self._make_sentence_attempts,
+                        min(
+                            deadline,
+                            time.monotonic()
+                            + self._refill_slice.total_seconds(),
+                        ),
+                    )
+                if text_version != self._text_version:
+                    return
+                self._sentence_pool.extend(sentences)
+        except Exception as ex:
+            self._log.error(
+                "Failed to refill sentence pool for {}: {}".format(
+                    self._knowledge_source, ex
+                )
+            )
+        finally:
+            self._sentence_pool_is_refilling = False
+
+    async def _restore_text(self):
+        try:
+            mark = await self._model_host.load(
+                self._model_id,
+                _text_from_snapshot,
+                self._snapshot_store,
+                self._knowledge_source,
+            )
+        except Exception as ex:
+            self._log.error(
+                "Failed to load snapshot for {}: {}".format(
+                    self._knowledge_source, ex
+                )
+            )
+            mark = None
+
+        if mark is None:
+            await self._build_text()
+            return
+        if self._is_closed:
+            await self._model_host.drop(self._model_id)
+            return
+
+        await self._measure_size()
+        self._on_new_text()
+        self._log.info(
+            "Restored text for {} from snapshot".format(self._knowledge_source)
+        )
+        try:
+            await self._catch_up(mark)
+        except Exception as ex:
+            self._log.error(
+                "Failed to catch up text for {}, rebuilding: {}".format(
+                    self._knowledge_source, ex
+                )
+            )
+            await self._build_text()
+            return
+        self._build_state = self.BuildState.READY
+        await self._absorb_pending_knowledge()
+
+    async def _catch_up(self, resume_token):
+        knowledge = []
+        while True:
+            changes = await self._knowledge_base.select_changes(
+                self._knowledge_source, resume_token, self._ingest_batch_size
+            )
+            knowledge.extend(changes.entries)
+            resume_token = changes.resume_token
+            if len(changes.entries) < self._ingest_batch_size:
+                break
+        self._pending_knowledge.extend(knowledge)
+        self._new_knowledge_count += len(knowledge)
 
     async def _build_text(self):
-        knowledge = await _async_join(
-            _strip_dots(self._knowledge_source()), sep=". "
+        self._build_state = self.BuildState.BUILDING
+        self._build_started = time.monotonic()
+        try:
+            mark = await self._knowledge_base.high_water_mark()
+            await self._model_host.stage(
+                self._model_id, _new_text_builder, self._engine
+            )
+            knowledge = []
+            async for entry in self._select_knowledge():
+                knowledge.append(entry)
+                if len(knowledge) >= self._ingest_batch_size:
+                    await self._model_host.feed(
+                        self._model_id, _ingest, knowledge
+                    )
+                    knowledge = []
+            await self._model_host.feed(self._model_id, _ingest, knowledge)
+            await self._model_host.commit(self._model_id, _build_staged_text)
+            if self._is_closed:
+                await self._model_host.drop(self._model_id)
+                return
+            await self._measure_size()
+        except Exception as ex:
+            self._build_state = self.BuildState.FAILED
+            self._log.error(
+                "Failed to build text for {}: {}".format(
+                    self._knowledge_source, ex
+                )
+            )
+        else:
+            self._build_state = self.BuildState.READY
+            self._on_new_text()
+        finally:
+            self._last_build_duration = datetime.timedelta(
+                seconds=time.monotonic() - self._build_started
+            )
+
+        if self._build_state == self.BuildState.READY:
+            self._log.info(
+                "Successfully built new text for {} in {}".format(
+                    self._knowledge_source, self._last_build_duration
+                )
+            )
+            await self._save_snapshot(mark)
+        await self._absorb_pending_knowledge()
+
+    def _select_knowledge(self):
+        if (
+            self._knowledge_source.scope == Scope.FULL_KNOWLEDGE
+            and self._full_knowledge_sample_size is not None
+        ):
+            return self._knowledge_base.sample_full_knowledge(
+                self._full_knowledge_sample_size,
+                newer_than=self._knowledge_horizon(),
+            )
+        return self._knowledge_source.select(
+            self._knowledge_base, newer_than=self._knowledge_horizon()
         )
-        self._text = await self._event_loop.run_in_executor(
-            self._worker, lambda: markovify.Text(knowledge)
+
+    def _knowledge_horizon(self):
+        if self._knowledge_window is None:
+            return None
+        return (
+            datetime.datetime.now(datetime.timezone.utc)
+            - self._knowledge_window
+        )
+
+    async def _measure_size(self):
+        self._size_bytes = await self._model_host.run(
+            self._model_id, _text_size
         )
-        self._log.info("Successfully built new text")
 
-    @contextlib.contextmanager
-    def _sentence_building_session(self):
-        self._sentence_is_building = True
+    async def _save_snapshot(self, mark):
         try:
-            yield
+            async with self._text_lock:
+                await self._model_host.run(
+                    self._model_id,
+                    _snapshot_text,
+                    self._snapshot_store,
+                    self._knowledge_source,
+                    mark,
+                )
         except Exception as ex:
             self._log.error(
-                "[CachedMarkovText] Failed to build sentence: {}".format(ex)
+                "Failed to save snapshot for {}: {}".format(
+                    self._knowledge_source, ex
+                )
             )
+
+    async def _absorb_pending_knowledge(self):
+        async with self._text_lock:
+            if self.is_building or not self._pending_knowledge:
+                return
+            knowledge, self._pending_knowledge = self._pending_knowledge, []
+            await self._model_host.run(self._model_id, _absorb, knowledge)
+        self._log.info(
+            "Absorbed {} new entries of knowledge".format(len(knowledge))
+        )
+
+    async def _drop_text(self):
+        async with self._text_lock:
+            await self._model_host.drop(self._model_id)
+
+    async def _serve_sentence_waiters(self):
+        try:
+            while self._sentence_waiters:
+                waiters = sorted(
+                    self._sentence_waiters, key=lambda waiter: waiter[0]
+                )
+                self._sentence_waiters.clear()
+                text_version = self._text_version
+                sentences, fallback = await self._build_sentences(
+                    len(waiters), self._cutoff(waiters[0][0])
+                )
+                for deadline, waiter in waiters:
+                    if waiter.done():
+                        continue
+                    if sentences:
+                        waiter.set_result(sentences.pop())
+                    elif fallback is not None:
+                        waiter.set_result(fallback)
+                        fallback = None
+                    elif time.monotonic() < self._cutoff(deadline):
+                        self._sentence_waiters.append((deadline, waiter))
+                    else:
+                        waiter.set_result(None)
+                if text_version == self._text_version:
+                    self._sentence_pool.extend(sentences)
         finally:
             self._sentence_is_building = False
 
-    async def _build_sentence(self):
-        text = self._text
-        make_sentence_attempts = self._make_sentence_attempts
-        return await self._event_loop.run_in_executor(
-            self._worker,
-            lambda: text.make_sentence(tries=make_sentence_attempts),
-        )
+    async def _build_sentences(self, count, cutoff):
+        try:
+            async with self._text_lock:
+                return await self._model_host.run(
+                    self._model_id,
+                    _make_sentences,
+                    count,
+                    self._make_sentence_attempts,
+                    cutoff,
+                    True,
+                )
+        except Exception as ex:
+            self._log.error(
+                "[CachedMarkovText] Failed to build sentences: {}".format(ex)
+            )
+            return [], None
 
 
 @logged
@@ -105,44 +560,80 @@ class MarkovChainIntelligenceCore(IntelligenceCore):
         BY_CURRENT_USER = enum.auto()
         BY_FULL_KNOWLEDGE = enum.auto()
 
-    _knowledge_base = attr.ib(
-        validator=attr.validators.instance_of(KnowledgeBase)
-    )
-    _text_constructor = attr.ib()
+    _text_cache = attr.ib(validator=attr.validators.instance_of(ModelCache))
     _markov_texts = attr.ib()
+    _reply_budget = attr.ib()
 
     @classmethod
-    def build(
-        cls,
+    def build(cls, chat_id, text_cache, reply_budget):
+        return cls(
+            text_cache=text_cache,
+            reply_budget=reply_budget,
+            markov_texts={
+                cls.Strategy.BY_CURRENT_CHAT: text_cache.acquire(
+                    KnowledgeSource.chat(chat_id)
+                ),
+                cls.Strategy.BY_FULL_KNOWLEDGE: text_cache.acquire(
+                    KnowledgeSource.full_knowledge()
+                ),
+            },
+        )
+
+    @staticmethod
+    def build_text_cache(
         event_loop,
-        worker,
-        chat_id,
+        model_host,
         knowledge_base,
-        knowledge_lifespan,
+        knowledge_feed,
+        snapshot_store,
+        engine,
+        tokenizer,
+        ingest_batch_size,
+        knowledge_window,
+        full_knowledge_sample_size,
+        rebuild_thresholds,
+        max_staleness,
         make_sentence_attempts,
+        sentence_pool_size,
+        sentence_queue_size,
+        sentence_budget,
+        fallback_margin,
+        refill_slice,
+        memory_budget,
     ):
         text_constructor = functools.partial(
             CachedMarkovText,
             event_loop=event_loop,
-            worker=worker,
+            model_host=model_host,
+            knowledge_base=knowledge_base,
+            knowledge_feed=knowledge_feed,
+            snapshot_store=snapshot_store,
+            engine=engine,
+            tokenizer=tokenizer,
+            ingest_batch_size=ingest_batch_size,
+            knowledge_window=knowledge_window,
+            full_knowledge_sample_size=full_knowledge_sample_size,
             make_sentence_attempts=make_sentence_attempts,
-            text_lifespan=knowledge_lifespan,
+            sentence_pool_size=sentence_pool_size,
+            sentence_queue_size=sentence_queue_size,
+            sentence_budget=sentence_budget,
+            fallback_margin=fallback_margin,
+            refill_slice=refill_slice,
+            max_staleness=max_staleness,
         )
-        return cls(
-            knowledge_base=knowledge_base,
-            text_constructor=text_constructor,
-            markov_texts={
-                cls.Strategy.BY_CURRENT_CHAT: text_constructor(
-                    knowledge_source=functools.partial(
-                        knowledge_base.select_by_chat, chat_id
-                    )
-                ),
-                cls.Strategy.BY_FULL_KNOWLEDGE: text_constructor(
-                    knowledge_source=knowledge_base.select_by_full_knowledge
-                ),
-            },
+        return ModelCache(
+            constructor=lambda source: text_constructor(
+                knowledge_source=source,
+                rebuild_threshold=rebuild_thresholds[source.scope],
+            ),
+            memory_budget=memory_budget,
         )
 
+    def close(self):
+        for text in self._markov_texts.values():
+            self._text_cache.release(text.knowledge_source)
+        self._markov_texts.clear()
+
     async def conceive(self):
         response = await self._form_message(
             strategies=[
@@ -160,22 +651,49 @@ class MarkovChainIntelligenceCore(IntelligenceCore):
                 self.Strategy.BY_FULL_KNOWLEDGE,
             ],
             user=user,
+            message=message,
         )
         return thought.text(response) if response is not None else None
 
-    async def _form_message(self, strategies, user=None):
+    async def _form_message(self, strategies, user=None, message=None):
+        deadline = time.monotonic() + self._reply_budget.total_seconds()
         strategy = random.choice(strategies)
-        if strategy == self.Strategy.BY_CURRENT_USER:
-            text_key = (strategy, user)
-            if text_key not in self._markov_texts:
-                self._markov_texts[text_key] = self._text_constructor(
-                    knowledge_source=functools.partial(
-                        self._knowledge_base.select_by_user, user
-                    )
-                )
-        else:
-            text_key = strategy
+        self._log.info("Using text for {}".format(strategy))
+
+        sentence = await self._make_sentence_by(
+            strategy, user, message, deadline
+        )
+        if sentence is not None:
+            return sentence
+
+        for fallback in strategies:
+            text = self._markov_texts.get(fallback)
+            if fallback == strategy or text is None:
+                continue
+            sentence = text.pooled_sentence()
+            if sentence is not None:
+                self._log.info("Falling back to {}".format(fallback))
+                return sentence
+        return None
+
+    async def _make_sentence_by(self, strategy, user, message, deadline):
+        if strategy != self.Strategy.BY_CURRENT_USER:
+            return await self._make_sentence(
+                self._markov_texts[strategy], message, deadline
+            )
+
+        source = KnowledgeSource.user(user)
+        text = self._text_cache.acquire(source)
+        try:
+            return await self._make_sentence(text, message, deadline)
+        finally:
+            self._text_cache.release(source)
 
-        self._log.info("Using text for {}".format(text_key))
+    async def _make_sentence(self, text, message, deadline):
+        if message:
+            sentence = await text.make_sentence_about(message, deadline)
+            if sentence is not None:
+                return sentence
+            self._log.info("Found nothing to say about the message")
 
-        return await self._markov_texts[text_key].make_sentence()
+        return await text.make_sentence(deadline)
@@ -0,0 +1,344 @@
+import enum
+import functools
+import itertools
+import random
+import time
+
+import attr
+import markovify
+from markovify.chain import BEGIN, END
+
+from blabbermouth.chat_text import ChatText
+from blabbermouth.compact_chain import CompactChain
+from blabbermouth.ngram_index import NgramIndex
+from blabbermouth.util import words as words_util
+
+_STATE_BYTES = 320
+_TRANSITION_BYTES = 104
+
+
+class Engine(enum.Enum):
+    MARKOVIFY = "markovify"
+    COMPACT = "compact"
+
+
+class Tokenizer(enum.Enum):
+    MARKOVIFY = "markovify"
+    CHAT = "chat"
+
+
+def _new_ngram_index(state_size):
+    return NgramIndex(
+        min_length=state_size + 2,
+        max_length=markovify.text.DEFAULT_MAX_OVERLAP_TOTAL + 1,
+    )
+
+
+def _count_transitions(model, corpus, state_size, weight=1):
+    new_states = []
+    for run in corpus:
+        items = [BEGIN] * state_size + run + [END]
+        for start in range(len(run) + 1):
+            end = start + state_size
+            state = tuple(items[start:end])
+            transitions = model.get(state)
+            if transitions is None:
+                transitions = model[state] = {}
+                new_states.append(state)
+            transitions[items[end]] = transitions.get(items[end], 0) + weight
+    return new_states
+
+
+def _index_states(state_index, states):
+    for state in states:
+        words = {words_util.normalize(word) for word in state if word != BEGIN}
+        for word in filter(None, words):
+            state_index.setdefault(word, []).append(state)
+
+
+@attr.s(slots=True)
+class Fallback:
+    words = attr.ib(default=None)
+    _overlap = attr.ib(default=None)
+
+    def offer(self, words, overlap):
+        if self._overlap is None or overlap < self._overlap:
+            self.words = words
+            self._overlap = overlap
+
+
+@attr.s(slots=True)
+class ChainTextBuilder:
+    _parser = attr.ib()
+    _ngram_index = attr.ib()
+    _model = attr.ib(factory=dict)
+
+    def ingest(self, knowledge):
+        for corpus, count in knowledge:
+            _count_transitions(
+                self._model, corpus, self._parser.state_size, count
+            )
+            for run in corpus:
+                self._ngram_index.add(run)
+
+    def build(self):
+        text_class = type(self._parser)
+        if not self._model:
+            return text_class(".")
+        return text_class(
+            None,
+            state_size=self._parser.state_size,
+            chain=markovify.Chain(
+                None, self._parser.state_size, model=self._model
+            ),
+            ngram_index=self._ngram_index,
+        )
+
+
+@attr.s(slots=True)
+class CompactTextBuilder:
+    _parser = attr.ib()
+    _chain = attr.ib()
+    _ngram_index = attr.ib()
+    _is_empty = attr.ib(default=True)
+
+    def ingest(self, knowledge):
+        for corpus, count in knowledge:
+            self._chain.absorb(corpus, count)
+            for run in corpus:
+                self._ngram_index.add(run)
+            self._is_empty = self._is_empty and not corpus
+
+    def build(self):
+        text_class = type(self._parser)
+        if self._is_empty:
+            return text_class(".")
+        self._chain.compact()
+        return text_class(
+            None,
+            state_size=self._parser.state_size,
+            chain=self._chain,
+            ngram_index=self._ngram_index,
+        )
+
+
+class ChainText(markovify.Text):
+    ENGINE = Engine.MARKOVIFY
+
+    def __init__(self, input_text, state_size=2, chain=None, ngram_index=None):
+        if chain is None:
+            ngram_index = _new_ngram_index(state_size)
+            corpus = list(self.generate_corpus(input_text))
+            for run in corpus:
+                ngram_index.add(run)
+            chain = markovify.Chain(corpus, state_size)
+
+        super().__init__(
+            None, state_size=state_size, chain=chain, retain_original=False
+        )
+        self.rejoined_text = None
+        self.ngram_index = ngram_index
+        self.state_index = {}
+        _index_states(self.state_index, self.chain.model)
+
+    @classmethod
+    def builder(cls):
+        parser = cls(".")
+        return ChainTextBuilder(
+            parser=parser, ngram_index=_new_ngram_index(parser.state_size)
+        )
+
+    @property
+    def size_bytes(self):
+        model = self.chain.model
+        return (
+            len(model) * _STATE_BYTES
+            + sum(map(len, model.values())) * _TRANSITION_BYTES
+            + self.ngram_index.size_bytes
+        )
+
+    def absorb(self, knowledge):
+        for corpus, count in knowledge:
+            _index_states(
+                self.state_index,
+                _count_transitions(
+                    self.chain.model, corpus, self.state_size, count
+                ),
+            )
+            for run in corpus:
+                self.ngram_index.add(run)
+        self.chain.precompute_begin_state()
+
+    def make_sentence_until(self, deadline, tries, fallback=None):
+        return self._make_sentence_until(
+            deadline, itertools.repeat(None, tries), fallback
+        )
+
+    def make_sentence_about(self, words, tries, deadline, fallback=None):
+        words = set(filter(None, map(words_util.normalize, words)))
+        candidates = sorted(
+            filter(None, map(self._states_with, words)), key=len
+        )
+        if not candidates:
+            return None
+        return self._make_sentence_until(
+            deadline,
+            (
+                self._seed_state(
+                    random.choice(candidates[attempt % len(candidates)])
+                )
+                for attempt in range(tries)
+            ),
+            fallback,
+        )
+
+    def test_sentence_output(
+        self, words, max_overlap_ratio, max_overlap_total
+    ):
+        overlap_max = min(
+            max_overlap_total, int(round(max_overlap_ratio * len(words)))
+        )
+        return not self.ngram_index.overlaps(words, overlap_max + 1)
+
+    def to_dict(self):
+        return dict(
+            super().to_dict(),
+            engine=self.ENGINE.value,
+            ngram_index=self.ngram_index.to_dict(),
+        )
+
+    @classmethod
+    def from_dict(cls, obj, **kwargs):
+        return cls(
+            None,
+            state_size=obj["state_size"],
+            chain=markovify.Chain.from_json(obj["chain"]),
+            ngram_index=NgramIndex.from_dict(obj["ngram_index"]),
+        )
+
+    def _make_sentence_until(self, deadline, init_states, fallback):
+        for init_state in init_states:
+            words = self._walk(init_state)
+            if self.test_sentence_output(
+                words,
+                markovify.text.DEFAULT_MAX_OVERLAP_RATIO,
+                markovify.text.DEFAULT_MAX_OVERLAP_TOTAL,
+            ):
+                return self.word_join(words)
+            if fallback is not None and words:
+                fallback.offer(
+                    words, self.ngram_index.longest_overlap(words) / len(words)
+                )
+            if time.monotonic() >= deadline:
+                break
+        return None
+
+    def _walk(self, init_state):
+        prefix = itertools.dropwhile(
+            lambda word: word == BEGIN, init_state or ()
+        )
+        return list(prefix) + self.chain.walk(init_state)
+
+    def _states_with(self, word):
+        return self.state_index.get(word, ())
+
+    def _seed_state(self, state):
+        return state
+
+
+class CompactText(ChainText):
+    ENGINE = Engine.COMPACT
+
+    def __init__(self, input_text, state_size=2, chain=None, ngram_index=None):
+        self.state_size = state_size
+        self.retain_original = False
+        self.rejoined_text = None
+
+        if chain is None:
+            ngram_index = _new_ngram_index(state_size)
+            chain = CompactChain.build(
+                self._index_ngrams(
+                    self.generate_corpus(input_text), ngram_index
+                ),
+                state_size,
+            )
+
+        self.chain = chain
+        self.ngram_index = ngram_index
+
+    @classmethod
+    def builder(cls):
+        parser = cls(".")
+        return CompactTextBuilder(
+            parser=parser,
+            chain=CompactChain(state_size=parser.state_size),
+            ngram_index=_new_ngram_index(parser.state_size),
+        )
+
+    @property
+    def size_bytes(self):
+        return self.chain.size_bytes + self.ngram_index.size_bytes
+
+    def absorb(self, knowledge):
+        for corpus, count in knowledge:
+            self.chain.absorb(self._index_ngrams(corpus), count)
+
+    def to_dict(self):
+        return {
+            "engine": self.ENGINE.value,
+            "state_size": self.state_size,
+            "chain": self.chain.to_dict(),
+            "ngram_index": self.ngram_index.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, obj, **kwargs):
+        return cls(
+            None,
+            state_size=obj["state_size"],
+            chain=CompactChain.from_dict(obj["chain"]),
+            ngram_index=NgramIndex.from_dict(obj["ngram_index"]),
+        )
+
+    def _states_with(self, word):
+        return self.chain.states_with(word)
+
+    def _seed_state(self, key):
+        return self.chain.unpack(key)
+
+    def _index_ngrams(self, corpus, ngram_index=None):
+        if ngram_index is None:
+            ngram_index = self.ngram_index
+        for run in corpus:
+            ngram_index.add(run)
+            yield run
+
+
+@functools.lru_cache(maxsize=None)
+def _tokenizer(tokenizer):
+    if tokenizer == Tokenizer.MARKOVIFY:
+        return markovify.Text(".")
+    if tokenizer == Tokenizer.CHAT:
+        return ChatText(".")
+    raise ValueError("Unexpected tokenizer: {}".format(tokenizer))
+
+
+def tokenize(text, tokenizer):
+    return list(_tokenizer(Tokenizer(tokenizer)).generate_corpus(text))
+
+
+def split_words(text, tokenizer):
+    return _tokenizer(Tokenizer(tokenizer)).word_split(text)
+
+
+def text_class(engine):
+    if engine == Engine.MARKOVIFY:
+        return ChainText
+    if engine == Engine.COMPACT:
+        return CompactText
+    raise ValueError("Unexpected chain engine: {}".format(engine))
+
+
+def from_dict(obj):
+    engine = Engine(obj.get("engine", Engine.MARKOVIFY.value))
+    return text_class(engine).from_dict(obj)
@@ -0,0 +1,68 @@
+import collections
+
+import attr
+
+from blabbermouth.util.log import logged
+
+
+@logged
+@attr.s(slots=True)
+class ModelCache:
+    @attr.s(slots=True)
+    class Entry:
+        model = attr.ib()
+        references = attr.ib(default=0)
+
+    _constructor = attr.ib()
+    _memory_budget = attr.ib()
+    _entries = attr.ib(factory=collections.OrderedDict)
+
+    @property
+    def size_bytes(self):
+        return sum(entry.model.size_bytes for entry in self._entries.values())
+
+    def acquire(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self._log.info("Creating model for {}".format(key))
+            entry = self.Entry(model=self._constructor(key))
+            self._entries[key] = entry
+        else:
+            self._entries.move_to_end(key)
+        entry.references += 1
+        self._evict()
+        return entry.model
+
+    def release(self, key):
+        entry = self._entries[key]
+        entry.references -= 1
+        if entry.references > 0:
+            return
+        self._evict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self):
+        size = self.size_bytes
+        for key, entry in tuple(self._entries.items()):
+            if size <= self._memory_budget:
+                return
+            if entry.references > 0 or entry.model.is_building:
+                continue
+
+            self._log.info(
+                "Evicting model for {} ({} bytes)".format(
+                    key, entry.model.size_bytes
+                )
+            )
+            size -= entry.model.size_bytes
+            del self._entries[key]
+            entry.model.close()
+
+        if size > self._memory_budget:
+            self._log.warning(
+                "Models in use take {} bytes, over budget of {}".format(
+                    size, self._memory_budget
+                )
+            )
@@ -0,0 +1,213 @@
+import concurrent.futures
+import enum
+import itertools
+import multiprocessing
+import os
+import pickle
+import tempfile
+
+import attr
+
+_MODELS = {}
+_STAGED_MODELS = {}
+_MODEL_IDS = itertools.count()
+
+
+def _install(model_id, model):
+    if model is not None:
+        _MODELS[model_id] = model
+
+
+def _load(model_id, loader, *args):
+    model, result = loader(*args)
+    _install(model_id, model)
+    return result
+
+
+def _spooled(model, result):
+    if model is None:
+        return None, result
+    fd, path = tempfile.mkstemp(prefix="blabbermouth-model-")
+    try:
+        with os.fdopen(fd, "wb") as spool:
+            pickle.dump(model, spool, protocol=pickle.HIGHEST_PROTOCOL)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, result
+
+
+def _load_spooled(loader, *args):
+    return _spooled(*loader(*args))
+
+
+def _install_spooled(model_id, path):
+    with open(path, "rb") as spool:
+        _install(model_id, pickle.load(spool))
+
+
+def _run(model_id, function, *args):
+    return function(_MODELS[model_id], *args)
+
+
+def _drop(model_id):
+    _MODELS.pop(model_id, None)
+    _STAGED_MODELS.pop(model_id, None)
+
+
+def _stage(model_id, factory, *args):
+    _STAGED_MODELS[model_id] = factory(*args)
+
+
+def _feed(model_id, function, *args):
+    return function(_STAGED_MODELS[model_id], *args)
+
+
+def _commit(model_id, finisher, *args):
+    model, result = finisher(_STAGED_MODELS.pop(model_id), *args)
+    _install(model_id, model)
+    return result
+
+
+def _commit_spooled(model_id, finisher, *args):
+    return _spooled(*finisher(_STAGED_MODELS.pop(model_id), *args))
+
+
+class Mode(enum.Enum):
+    THREAD = "thread"
+    PROCESS = "process"
+
+
+@attr.s(slots=True)
+class ThreadModelHost:
+    _event_loop = attr.ib()
+    _executor = attr.ib()
+
+    @staticmethod
+    def allocate():
+        return next(_MODEL_IDS)
+
+    async def load(self, model_id, loader, *args):
+        return await self._event_loop.run_in_executor(
+            self._executor, _load, model_id, loader, *args
+        )
+
+    async def run(self, model_id, function, *args):
+        return await self._event_loop.run_in_executor(
+            self._executor, _run, model_id, function, *args
+        )
+
+    async def stage(self, model_id, factory, *args):
+        return await self._event_loop.run_in_executor(
+            self._executor, _stage, model_id, factory, *args
+        )
+
+    async def feed(self, model_id, function, *args):
+        return await self._event_loop.run_in_executor(
+            self._executor, _feed, model_id, function, *args
+        )
+
+    async def commit(self, model_id, finisher, *args):
+        return await self._event_loop.run_in_executor(
+            self._executor, _commit, model_id, finisher, *args
+        )
+
+    async def drop(self, model_id):
+        _drop(model_id)
+
+
+@attr.s(slots=True)
+class ProcessModelHost:
+    _event_loop = attr.ib()
+    _loaders = attr.ib()
+    _shards = attr.ib()
+
+    @classmethod
+    def build(cls, event_loop, workers):
+        context = multiprocessing.get_context("forkserver")
+        return cls(
+            event_loop=event_loop,
+            loaders=[
+                concurrent.futures.ProcessPoolExecutor(
+                    max_workers=1, mp_context=context
+                )
+                for _ in range(workers)
+            ],
+            shards=[
+                concurrent.futures.ProcessPoolExecutor(
+                    max_workers=1, mp_context=context
+                )
+                for _ in range(workers)
+            ],
+        )
+
+    @staticmethod
+    def allocate():
+        return next(_MODEL_IDS)
+
+    async def load(self, model_id, loader, *args):
+        path, result = await self._event_loop.run_in_executor(
+            self._loader(model_id), _load_spooled, loader, *args
+        )
+        await self._install(model_id, path)
+        return result
+
+    async def run(self, model_id, function, *args):
+        return await self._event_loop.run_in_executor(
+            self._shard(model_id), _run, model_id, function, *args
+        )
+
+    async def stage(self, model_id, factory, *args):
+        return await self._event_loop.run_in_executor(
+            self._loader(model_id), _stage, model_id, factory, *args
+        )
+
+    async def feed(self, model_id, function, *args):
+        return await self._event_loop.run_in_executor(
+            self._loader(model_id), _feed, model_id, function, *args
+        )
+
+    async def commit(self, model_id, finisher, *args):
+        path, result = await self._event_loop.run_in_executor(
+            self._loader(model_id), _commit_spooled, model_id, finisher, *args
+        )
+        await self._install(model_id, path)
+        return result
+
+    async def drop(self, model_id):
+        await self._event_loop.run_in_executor(
+            self._loader(model_id), _drop, model_id
+        )
+        await self._event_loop.run_in_executor(
+            self._shard(model_id), _drop, model_id
+        )
+
+    async def _install(self, model_id, path):
+        if path is None:
+            return
+        try:
+            await self._event_loop.run_in_executor(
+                self._shard(model_id), _install_spooled, model_id, path
+            )
+        finally:
+            os.remove(path)
+
+    def _loader(self, model_id):
+        return self._loaders[model_id % len(self._loaders)]
+
+    def _shard(self, model_id):
+        return self._shards[model_id % len(self._shards)]
+
+
+def build(event_loop, mode, workers):
+    mode = Mode(mode)
+    if mode == Mode.THREAD:
+        return ThreadModelHost(
+            event_loop=event_loop,
+            executor=concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers
+            ),
+        )
+    if mode == Mode.PROCESS:
+        return ProcessModelHost.build(event_loop=event_loop, workers=workers)
+    raise ValueError("Unexpected model host mode: {}".format(mode))
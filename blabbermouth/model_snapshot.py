@@ -0,0 +1,63 @@
+import json
+import os
+import urllib.parse
+
+import attr
+
+from blabbermouth import markov_text
+from blabbermouth.util.log import logged
+
+
+@attr.s(slots=True, frozen=True)
+class ModelSnapshot:
+    mark = attr.ib()
+    text = attr.ib()
+
+
+@logged
+@attr.s(slots=True)
+class ModelSnapshotStore:
+    VERSION = 2
+
+    _directory = attr.ib()
+
+    def __attrs_post_init__(self):
+        os.makedirs(self._directory, exist_ok=True)
+
+    def save(self, source, snapshot):
+        path = self._path(source)
+        with open(path + ".tmp", "w") as fd:
+            json.dump(
+                {
+                    "version": self.VERSION,
+                    "mark": snapshot.mark,
+                    "text": snapshot.text.to_dict(),
+                },
+                fd,
+            )
+        os.replace(path + ".tmp", path)
+
+    def load(self, source):
+        try:
+            with open(self._path(source)) as fd:
+                data = json.load(fd)
+        except FileNotFoundError:
+            return None
+
+        if data.get("version") != self.VERSION:
+            self._log.warning(
+                "Ignoring snapshot of unknown version {} for {}".format(
+                    data.get("version"), source
+                )
+            )
+            return None
+
+        return ModelSnapshot(
+            mark=data["mark"], text=markov_text.from_dict(data["text"])
+        )
+
+    def _path(self, source):
+        name = source.scope.name.lower()
+        if source.key is not None:
+            name += "-" + urllib.parse.quote(str(source.key), safe="")
+        return os.path.join(self._directory, name + ".json")
@@ -1,31 +1,187 @@
+import hashlib
+import time
+
 import attr
+import bson
 import motor.motor_asyncio
+import pymongo
+
+from blabbermouth import markov_text
+from blabbermouth.knowledge_base import (
+    Changes,
+    KnowledgeBase,
+    PartialRecordError,
+)
+from blabbermouth.knowledge_source import Scope
+
+_PROJECTION = {"_id": False, "text": True, "tokens": True, "count": True}
+
+
+def _source_query(source):
+    if source.scope == Scope.FULL_KNOWLEDGE:
+        return {}
+    if source.scope == Scope.CHAT:
+        return {"chat_id": source.key}
+    if source.scope == Scope.USER:
+        return {"user": source.key}
+    raise ValueError("Unexpected knowledge scope: {}".format(source.scope))
+
+
+def _entry(doc, tokenizer):
+    tokens = doc.get("tokens")
+    if tokens is None:
+        tokens = markov_text.tokenize(doc["text"], tokenizer)
+    return tokens, doc.get("count", 1)
+
 
-from blabbermouth.knowledge_base import KnowledgeBase
+def _content_hash(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
 
 
 @attr.s(slots=True)
 class MongoKnowledgeBase(KnowledgeBase):
     _client = attr.ib()
     _collection = attr.ib()
+    _cursor_batch_size = attr.ib()
+    _tokenizer = attr.ib()
+    _dedupe_bucket = attr.ib()
 
     @classmethod
-    def build(cls, host, port, db_name, db_collection):
+    def build(
+        cls,
+        host,
+        port,
+        db_name,
+        db_collection,
+        cursor_batch_size,
+        tokenizer,
+        dedupe_bucket,
+    ):
         client = motor.motor_asyncio.AsyncIOMotorClient(host, port)
-        return cls(client=client, collection=client[db_name][db_collection])
+        return cls(
+            client=client,
+            collection=client[db_name][db_collection],
+            cursor_batch_size=cursor_batch_size,
+            tokenizer=tokenizer,
+            dedupe_bucket=dedupe_bucket,
+        )
+
+    async def create_indexes(self):
+        await self._collection.create_indexes(
+            [
+                pymongo.IndexModel(
+                    [
+                        ("chat_id", pymongo.ASCENDING),
+                        ("user", pymongo.ASCENDING),
+                        ("hash", pymongo.ASCENDING),
+                        ("bucket", pymongo.ASCENDING),
+                    ]
+                ),
+                pymongo.IndexModel(
+                    [
+                        ("chat_id", pymongo.ASCENDING),
+                        ("_id", pymongo.ASCENDING),
+                    ]
+                ),
+                pymongo.IndexModel(
+                    [("user", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)]
+                ),
+            ]
+        )
+
+    async def record(self, chat_id, user, text, tokens):
+        await self.record_many([(chat_id, user, text, tokens, 1)])
+
+    async def record_many(self, records):
+        try:
+            await self._bulk_write(records)
+        except pymongo.errors.BulkWriteError as ex:
+            failed = sorted(
+                error["index"] for error in ex.details["writeErrors"]
+            )
+            if not failed:
+                raise
+            raise PartialRecordError(
+                [records[index] for index in failed]
+            ) from ex
+
+    async def _bulk_write(self, records):
+        bucket = int(time.time() // self._dedupe_bucket.total_seconds())
+        await self._collection.bulk_write(
+            [
+                pymongo.UpdateOne(
+                    {
+                        "chat_id": chat_id,
+                        "user": user,
+                        "hash": _content_hash(text),
+                        "bucket": bucket,
+                    },
+                    {
+                        "$setOnInsert": {"text": text, "tokens": tokens},
+                        "$inc": {"count": count},
+                    },
+                    upsert=True,
+                )
+                for chat_id, user, text, tokens, count in records
+            ],
+            ordered=False,
+        )
+
+    async def high_water_mark(self):
+        doc = await self._collection.find_one(
+            {}, projection=["_id"], sort=[("_id", pymongo.DESCENDING)]
+        )
+        return str(doc["_id"]) if doc is not None else None
+
+    async def select_changes(self, source, resume_token, limit):
+        query = _source_query(source)
+        if resume_token is not None:
+            query["_id"] = {"$gt": bson.ObjectId(resume_token)}
+        docs = await self._collection.find(
+            query,
+            projection=_PROJECTION,
+            sort=[("_id", pymongo.ASCENDING)],
+            limit=limit,
+        ).to_list(length=limit)
+        return Changes(
+            entries=[_entry(doc, self._tokenizer) for doc in docs],
+            resume_token=str(docs[-1]["_id"]) if docs else resume_token,
+        )
+
+    async def select_by_chat(self, chat_id, newer_than=None):
+        async for text in self._select({"chat_id": chat_id}, newer_than):
+            yield text
+
+    async def select_by_user(self, user, newer_than=None):
+        async for text in self._select({"user": user}, newer_than):
+            yield text
 
-    async def record(self, chat_id, user, text):
-        doc = {"chat_id": chat_id, "user": user, "text": text}
-        await self._collection.insert_one(doc)
+    async def select_by_full_knowledge(self, newer_than=None):
+        async for text in self._select({}, newer_than):
+            yield text
 
-    async def select_by_chat(self, chat_id):
-        async for doc in self._collection.find({"chat_id": chat_id}):
-            yield doc["text"]
+    async def sample_full_knowledge(self, size, newer_than=None):
+        pipeline = [{"$sample": {"size": size}}, {"$project": _PROJECTION}]
+        query = self._query({}, newer_than)
+        if query:
+            pipeline.insert(0, {"$match": query})
+        async for doc in self._collection.aggregate(
+            pipeline, allowDiskUse=True, batchSize=self._cursor_batch_size
+        ):
+            yield _entry(doc, self._tokenizer)
 
-    async def select_by_user(self, user):
-        async for doc in self._collection.find({"user": user}):
-            yield doc["text"]
+    async def _select(self, query, newer_than):
+        async for doc in self._collection.find(
+            self._query(query, newer_than),
+            projection=_PROJECTION,
+            batch_size=self._cursor_batch_size,
+        ):
+            yield _entry(doc, self._tokenizer)
 
-    async def select_by_full_knowledge(self):
-        async for doc in self._collection.find({}):
-            yield doc["text"]
+    @staticmethod
+    def _query(query, newer_than):
+        if newer_than is not None:
+            query = dict(
+                query, _id={"$gte": bson.ObjectId.from_datetime(newer_than)}
+            )
+        return query
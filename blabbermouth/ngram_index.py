@@ -0,0 +1,87 @@
+import zlib
+
+import attr
+
+from blabbermouth.util.bloom_filter import BloomFilter
+
+_MASK_64 = (1 << 64) - 1
+_MULTIPLIER = 1000003
+
+
+def _word_hashes(words):
+    return [zlib.crc32(word.encode("utf-8")) for word in words]
+
+
+def _combine(value, word_hash):
+    return (value * _MULTIPLIER + word_hash) & _MASK_64
+
+
+@attr.s(slots=True)
+class NgramIndex:
+    _min_length = attr.ib()
+    _max_length = attr.ib()
+    _ngrams = attr.ib(factory=BloomFilter)
+
+    @property
+    def size_bytes(self):
+        return self._ngrams.size_bytes
+
+    def add(self, words):
+        hashes = _word_hashes(words)
+        for start in range(len(hashes)):
+            end = min(start + self._max_length, len(hashes))
+            value = 0
+            for length, word_hash in enumerate(hashes[start:end], 1):
+                value = _combine(value, word_hash)
+                if length >= self._min_length:
+                    self._ngrams.add(value)
+
+    def overlaps(self, words, length):
+        length = min(length, len(words))
+        if length < self._min_length:
+            return True
+        if length > self._max_length:
+            length = self._max_length
+
+        hashes = _word_hashes(words)
+        for start in range(len(hashes) - length + 1):
+            end = start + length
+            value = 0
+            for word_hash in hashes[start:end]:
+                value = _combine(value, word_hash)
+            if value in self._ngrams:
+                return True
+        return False
+
+    def longest_overlap(self, words):
+        if len(words) < self._min_length:
+            return len(words)
+
+        hashes = _word_hashes(words)
+        longest = 0
+        for start in range(len(hashes)):
+            end = min(start + self._max_length, len(hashes))
+            value = 0
+            for length, word_hash in enumerate(hashes[start:end], 1):
+                value = _combine(value, word_hash)
+                if length < self._min_length:
+                    continue
+                if value not in self._ngrams:
+                    break
+                longest = max(longest, length)
+        return longest
+
+    def to_dict(self):
+        return {
+            "min_length": self._min_length,
+            "max_length": self._max_length,
+            "ngrams": self._ngrams.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, obj):
+        return cls(
+            min_length=obj["min_length"],
+            max_length=obj["max_length"],
+            ngrams=BloomFilter.from_dict(obj["ngrams"]),
+        )
@@ -0,0 +1,99 @@
+import base64
+import math
+
+import attr
+
+_MASK_32 = (1 << 32) - 1
+
+
+@attr.s(slots=True)
+class _Segment:
+    capacity = attr.ib()
+    hashes = attr.ib()
+    bits = attr.ib()
+    count = attr.ib(default=0)
+
+    @classmethod
+    def build(cls, capacity, error_rate):
+        size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        return cls(
+            capacity=capacity,
+            hashes=max(1, round(size / capacity * math.log(2))),
+            bits=bytearray((size + 7) // 8),
+        )
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(value)
+        )
+
+    def _positions(self, value):
+        size = len(self.bits) * 8
+        low, high = value & _MASK_32, (value >> 32) | 1
+        return ((low + i * high) % size for i in range(self.hashes))
+
+
+@attr.s(slots=True)
+class BloomFilter:
+    _initial_capacity = attr.ib(default=1 << 16)
+    _error_rate = attr.ib(default=0.001)
+    _segments = attr.ib(factory=list)
+
+    def add(self, value):
+        if not self._segments or (
+            self._segments[-1].count >= self._segments[-1].capacity
+        ):
+            self._segments.append(
+                _Segment.build(
+                    capacity=self._initial_capacity << len(self._segments),
+                    error_rate=self._error_rate,
+                )
+            )
+        self._segments[-1].add(value)
+
+    def __contains__(self, value):
+        return any(value in segment for segment in self._segments)
+
+    def __len__(self):
+        return sum(segment.count for segment in self._segments)
+
+    @property
+    def size_bytes(self):
+        return sum(len(segment.bits) for segment in self._segments)
+
+    def to_dict(self):
+        return {
+            "initial_capacity": self._initial_capacity,
+            "error_rate": self._error_rate,
+            "segments": [
+                {
+                    "capacity": segment.capacity,
+                    "hashes": segment.hashes,
+                    "count": segment.count,
+                    "bits": base64.b64encode(segment.bits).decode("ascii"),
+                }
+                for segment in self._segments
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, obj):
+        return cls(
+            initial_capacity=obj["initial_capacity"],
+            error_rate=obj["error_rate"],
+            segments=[
+                _Segment(
+                    capacity=segment["capacity"],
+                    hashes=segment["hashes"],
+                    count=segment["count"],
+                    bits=bytearray(base64.b64decode(segment["bits"])),
+                )
+                for segment in obj["segments"]
+            ],
+        )
@@ -0,0 +1,7 @@
+import string
+
+_PUNCTUATION = string.punctuation + "«»„“”‘’…—–¿¡"
+
+
+def normalize(word):
+    return word.strip(_PUNCTUATION).casefold()
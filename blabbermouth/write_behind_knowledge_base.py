@@ -0,0 +1,169 @@
+import asyncio
+import collections
+import datetime
+import time
+
+import attr
+
+from blabbermouth.knowledge_base import KnowledgeBase, PartialRecordError
+from blabbermouth.util.log import logged
+
+
+@logged
+@attr.s(slots=True)
+class WriteBehindKnowledgeBase(KnowledgeBase):
+    _event_loop = attr.ib()
+    _knowledge_base = attr.ib(
+        validator=attr.validators.instance_of(KnowledgeBase)
+    )
+    _flush_size = attr.ib()
+    _flush_interval = attr.ib(
+        validator=attr.validators.instance_of(datetime.timedelta)
+    )
+    _max_pending = attr.ib()
+    _close_timeout = attr.ib(
+        validator=attr.validators.instance_of(datetime.timedelta)
+    )
+    _pending = attr.ib(factory=collections.Counter)
+    _pending_tokens = attr.ib(factory=dict)
+    _flush_lock = attr.ib(factory=asyncio.Lock)
+    _flush_timer = attr.ib(default=None)
+    _flush_latency = attr.ib(default=None)
+
+    @property
+    def queue_depth(self):
+        return len(self._pending)
+
+    @property
+    def flush_latency(self):
+        return self._flush_latency
+
+    async def record(self, chat_id, user, text, tokens):
+        while len(self._pending) >= self._max_pending:
+            self._log.warning(
+                "Write buffer is full ({} entries), waiting for flush".format(
+                    len(self._pending)
+                )
+            )
+            if self._flush_timer is None:
+                await self._flush(min_entries=self._max_pending)
+            else:
+                await asyncio.wait([self._flush_timer])
+
+        self._pending[(chat_id, user, text)] += 1
+        self._pending_tokens[(chat_id, user, text)] = tokens
+        if len(self._pending) >= self._flush_size:
+            await self._flush(min_entries=self._flush_size)
+        elif self._flush_timer is None:
+            self._flush_timer = self._event_loop.create_task(
+                self._flush_later()
+            )
+
+    async def flush(self):
+        await self._flush(min_entries=1)
+
+    async def close(self):
+        deadline = time.monotonic() + self._close_timeout.total_seconds()
+        await self.flush()
+        while self._pending and time.monotonic() < deadline:
+            await asyncio.sleep(
+                min(
+                    self._flush_interval.total_seconds(),
+                    deadline - time.monotonic(),
+                )
+            )
+            await self.flush()
+
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if self._pending:
+            self._log.error(
+                "Dropping {} unflushed entries ({} messages) on close".format(
+                    len(self._pending), sum(self._pending.values())
+                )
+            )
+        await self._knowledge_base.close()
+
+    async def high_water_mark(self):
+        return await self._knowledge_base.high_water_mark()
+
+    async def select_changes(self, source, resume_token, limit):
+        return await self._knowledge_base.select_changes(
+            source, resume_token, limit
+        )
+
+    def select_by_full_knowledge(self, newer_than=None):
+        return self._knowledge_base.select_by_full_knowledge(
+            newer_than=newer_than
+        )
+
+    def sample_full_knowledge(self, size, newer_than=None):
+        return self._knowledge_base.sample_full_knowledge(
+            size, newer_than=newer_than
+        )
+
+    def select_by_chat(self, chat_id, newer_than=None):
+        return self._knowledge_base.select_by_chat(
+            chat_id, newer_than=newer_than
+        )
+
+    def select_by_user(self, user, newer_than=None):
+        return self._knowledge_base.select_by_user(user, newer_than=newer_than)
+
+    async def _flush(self, min_entries):
+        async with self._flush_lock:
+            if len(self._pending) < min_entries:
+                return
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+
+            pending, self._pending = self._pending, collections.Counter()
+            tokens, self._pending_tokens = self._pending_tokens, {}
+            started = time.monotonic()
+            try:
+                await self._knowledge_base.record_many(
+                    [
+                        key + (tokens[key], count)
+                        for key, count in pending.items()
+                    ]
+                )
+            except PartialRecordError as ex:
+                self._log.error(
+                    "Failed to flush {} of {} entries: {}".format(
+                        len(ex.failed_records), len(pending), ex.__cause__
+                    )
+                )
+                for chat_id, user, text, _, count in ex.failed_records:
+                    key = (chat_id, user, text)
+                    self._pending[key] += count
+                    self._pending_tokens[key] = tokens[key]
+                self._flush_timer = self._event_loop.create_task(
+                    self._flush_later()
+                )
+                return
+            except Exception as ex:
+                self._log.error(
+                    "Failed to flush {} entries: {}".format(len(pending), ex)
+                )
+                self._pending.update(pending)
+                self._pending_tokens.update(tokens)
+                self._flush_timer = self._event_loop.create_task(
+                    self._flush_later()
+                )
+                return
+            finally:
+                self._flush_latency = datetime.timedelta(
+                    seconds=time.monotonic() - started
+                )
+            self._log.debug(
+                "Flushed {} entries in {}".format(
+                    len(pending), self._flush_latency
+                )
+            )
+
+    async def _flush_later(self):
+        await asyncio.sleep(self._flush_interval.total_seconds())
+        self._flush_timer = None
+        await self.flush()